@@ -0,0 +1,8 @@
+"""FactoIRC benchmarks
+
+Run them all from the source tree with:
+
+    python -m benchmarks [--log console.log[.gz]] [--lines N]
+
+Each benchmark can also be run alone, eg python -m benchmarks.log_parser
+"""
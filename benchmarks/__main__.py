@@ -0,0 +1,24 @@
+import asyncio
+
+from . import log_parser, templates, readers, rcon
+from .corpus import corpus
+from .cli import parser
+
+
+def main():
+    args = parser('Run all the FactoIRC benchmarks')
+    args.add_argument('--commands', type=int, default=2000,
+                      help='number of RCON commands (default: %(default)s)')
+    args = args.parse_args()
+
+    loop = asyncio.get_event_loop()
+    lines = corpus(args.log, args.lines)
+
+    log_parser.bench(loop, lines)
+    templates.bench(args.lines)
+    readers.bench(loop, lines)
+    rcon.bench(loop, args.commands)
+
+
+if __name__ == '__main__':
+    main()
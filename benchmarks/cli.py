@@ -0,0 +1,12 @@
+import argparse
+
+
+def parser(description):
+    args = argparse.ArgumentParser(description=description)
+    args.add_argument('--lines', type=int, default=200000,
+                      help='number of synthetic log lines '
+                           '(default: %(default)s)')
+    args.add_argument('--log', metavar='FILE',
+                      help='use a recorded (possibly gzipped) console log '
+                           'instead of a synthetic one')
+    return args
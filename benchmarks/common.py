@@ -0,0 +1,90 @@
+"""Helpers shared by the benchmarks"""
+
+import time
+import tracemalloc
+
+
+def percentile(values, q):
+    """Return the `q` percentile (0-100) of `values`"""
+
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class Measure:
+    """Context manager measuring the elapsed time, and the peak memory if
+    `trace` is set
+
+    Tracing memory allocations slows Python code down a lot, so time and
+    memory should be measured in separate runs (see `measure()`).
+    """
+
+    peak = None
+
+    def __init__(self, trace=False):
+        self.trace = trace
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        if self.trace:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def measure(run):
+    """Call `run()` twice: timed, then with memory tracing
+
+    Return the Measure of the timed run (with the peak memory of the
+    other one) and the result of the timed run.
+    """
+
+    with Measure() as timing:
+        result = run()
+    with Measure(trace=True) as memory:
+        run()
+    timing.peak = memory.peak
+    return timing, result
+
+
+async def measure_async(run):
+    """Like `measure()`, for a coroutine function"""
+
+    with Measure() as timing:
+        result = await run()
+    with Measure(trace=True) as memory:
+        await run()
+    timing.peak = memory.peak
+    return timing, result
+
+
+def report(name, count, measure, unit='lines', latencies=None):
+    """Print a benchmark result line and return it as a dict"""
+
+    result = dict(
+        name=name,
+        count=count,
+        seconds=measure.elapsed,
+        rate=count / measure.elapsed if measure.elapsed else float('inf'),
+        peak_kib=measure.peak / 1024,
+    )
+    line = '%-28s %9d %s in %7.3fs  %10.0f %s/s  peak %8.1f KiB' % (
+        name, count, unit, measure.elapsed, result['rate'], unit,
+        result['peak_kib'])
+
+    if latencies is not None:
+        result.update(p50_ms=percentile(latencies, 50) * 1000,
+                      p99_ms=percentile(latencies, 99) * 1000)
+        line += '  p50 %.3fms  p99 %.3fms' % (
+            result['p50_ms'], result['p99_ms'])
+
+    print(line)
+    return result
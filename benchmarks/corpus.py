@@ -0,0 +1,63 @@
+"""Factorio log corpus for the benchmarks
+
+Either synthetic (verbose server log noise with some chat messages,
+actions and join/leave events) or loaded from a recorded console log,
+possibly gzip-compressed.
+"""
+
+import gzip
+import random
+
+
+NOISE = [
+    '{uptime:>8.3f} Verbose ServerMultiplayerManager.cpp:{n}: '
+    'updateTick({tick}) received stateChanged peerID({peer})',
+    '{uptime:>8.3f} Verbose ServerSynchronizer.cpp:{n}: '
+    'nextHeartbeatSequenceNumber({tick}) peerID({peer})',
+    '{uptime:>8.3f} Info ServerMultiplayerManager.cpp:{n}: '
+    'Matching server connection resumed',
+    '{uptime:>8.3f} Verbose MultiplayerManager.cpp:{n}: '
+    'MapTick({tick}) processed {{type: ChangeRidingState}} peerID({peer})',
+]
+
+EVENTS = [
+    '{date} [CHAT] player{peer}: hello everyone, how is the factory going?',
+    '{date} [CHAT] <server>: message from the console',
+    '{date} [COMMAND] player{peer} (command): game.player.print(42)',
+    '{date} [KICK] player{peer} was kicked by admin. Reason: spam.',
+    '{uptime:>8.3f} Info ServerMultiplayerManager.cpp:{n}: '
+    'Received peer info for peer({peer}) username(player{peer}).',
+    '{uptime:>8.3f} Info ServerMultiplayerManager.cpp:{n}: '
+    'MapTick({tick}) processed PlayerJoinGame peerID({peer}) '
+    'playerIndex({peer}) mode(connect)',
+    '{uptime:>8.3f} Info ServerMultiplayerManager.cpp:{n}: '
+    'MapTick({tick}) processed PlayerLeaveGame peerID({peer}) '
+    'playerIndex({peer}) mode(connect)',
+]
+
+
+def synthetic_log(count, event_ratio=0.1, seed=0):
+    """Return `count` log lines, `event_ratio` of them being events"""
+
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        templates = EVENTS if rnd.random() < event_ratio else NOISE
+        lines.append(rnd.choice(templates).format(
+            uptime=i / 100, n=rnd.randint(100, 999), tick=i,
+            peer=rnd.randint(1, 50), date='2017-05-01 12:00:00'))
+    return lines
+
+
+def load_log(path):
+    """Return the lines of a recorded log (.gz files are decompressed)"""
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        return [line.rstrip('\n') for line in f]
+
+
+def corpus(path=None, count=200000, event_ratio=0.1):
+    if path:
+        return load_log(path)
+    return synthetic_log(count, event_ratio)
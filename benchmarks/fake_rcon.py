@@ -0,0 +1,73 @@
+"""In-process Factorio RCON server stub for the benchmarks
+
+It speaks the RCON wire format (see factoirc.rcon.RconPacket): it checks
+the password of auth packets and answers every command, optionally after
+a delay and split into several packets.
+"""
+
+import asyncio
+import struct
+
+from factoirc.rcon import (RconPacket, SERVERDATA_AUTH,
+                           SERVERDATA_AUTH_RESPONSE, SERVERDATA_EXECCOMMAND,
+                           SERVERDATA_RESPONSE_VALUE)
+
+
+class FakeRconServer:
+    header = struct.Struct('<3i')
+
+    def __init__(self, password='password', handler=None, delay=0,
+                 fragment_size=None, loop=None):
+        self.password = password.encode('utf-8')
+        self.handler = handler or (lambda command: '')
+        self.delay = delay
+        self.fragment_size = fragment_size
+        self.loop = loop or asyncio.get_event_loop()
+        self.server = None
+        self.connections = 0
+        self.commands = []  # (time received, command)
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(
+            self.handle, host, port)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        return self
+
+    def close(self):
+        self.server.close()
+
+    def respond(self, writer, pkt_id, body):
+        if not self.fragment_size or not body:
+            writer.write(RconPacket(
+                pkt_id, SERVERDATA_RESPONSE_VALUE, body).pack())
+            return
+        for i in range(0, len(body), self.fragment_size):
+            writer.write(RconPacket(
+                pkt_id, SERVERDATA_RESPONSE_VALUE,
+                body[i:i + self.fragment_size]).pack())
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                header = await reader.readexactly(self.header.size)
+                size, pkt_id, pkt_type = self.header.unpack(header)
+                body = (await reader.readexactly(size - 8))[:-2]
+
+                if pkt_type == SERVERDATA_AUTH:
+                    ok = body == self.password
+                    writer.write(RconPacket(
+                        pkt_id if ok else -1,
+                        SERVERDATA_AUTH_RESPONSE).pack())
+                elif pkt_type == SERVERDATA_EXECCOMMAND:
+                    command = body.decode('utf-8')
+                    self.commands.append((self.loop.time(), command))
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    self.respond(writer, pkt_id,
+                                 self.handler(command).encode('utf-8'))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,50 @@
+"""LogParser.parse_line throughput, with and without the repeat
+suppression"""
+
+import asyncio
+import logging
+
+from factoirc.log_parser import LogParser
+from factoirc.suppression import RepeatSuppressor
+
+from .common import measure, report
+from .corpus import corpus
+from .cli import parser
+
+
+def bench(loop, lines):
+    logger = logging.getLogger('bench')
+    results = []
+
+    def parse():
+        parse_line = LogParser(logger).parse_line
+        for line in lines:
+            parse_line(line)
+
+    timing, _ = measure(parse)
+    results.append(report('LogParser.parse_line', len(lines), timing))
+
+    def suppress():
+        parse_line = LogParser(logger).parse_line
+        suppressor = RepeatSuppressor(loop, lambda count, event: None)
+        allow = suppressor.allow
+        for line in lines:
+            event = parse_line(line)
+            if event:
+                allow(event)
+        suppressor.close()
+
+    timing, _ = measure(suppress)
+    results.append(report('parse_line + RepeatSuppressor', len(lines),
+                          timing))
+
+    return results
+
+
+def main(args=None):
+    args = parser(__doc__).parse_args(args)
+    bench(asyncio.get_event_loop(), corpus(args.log, args.lines))
+
+
+if __name__ == '__main__':
+    main()
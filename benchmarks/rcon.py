@@ -0,0 +1,125 @@
+"""RCON latency and throughput against an in-process server stub
+
+- Sequential commands on a pooled connection, with and without
+  pipelining.
+- Concurrent commands on a pipelined connection.
+- End-to-end IRC -> game forwarding: a burst of messages is queued in the
+  RconForwarder (with the plugin's default batching settings), and the
+  time until each message reaches the server is measured.
+"""
+
+import asyncio
+import logging
+
+from factoirc import DEFAULT_CONFIG
+from factoirc.rcon import RconPool
+from factoirc.forwarding import RconForwarder
+
+from .common import measure_async, report
+from .fake_rcon import FakeRconServer
+from .cli import parser
+
+
+async def sequential(loop, server, count, pipelined):
+    async def run():
+        pool = RconPool(server.host, server.port, server.password.decode(),
+                        loop=loop, pipelined=pipelined)
+        latencies = []
+        for i in range(count):
+            start = loop.time()
+            await pool.exec_command('/silent-command %d' % i)
+            latencies.append(loop.time() - start)
+        pool.close()
+        return latencies
+
+    timing, latencies = await measure_async(run)
+    return report('RCON sequential%s' % (' (pipelined)' if pipelined else ''),
+                  count, timing, unit='cmds', latencies=latencies)
+
+
+async def concurrent(loop, server, count, concurrency):
+    async def run():
+        pool = RconPool(server.host, server.port, server.password.decode(),
+                        loop=loop, pipelined=True)
+        latencies = []
+
+        async def worker(n):
+            for i in range(n):
+                start = loop.time()
+                await pool.exec_command('/silent-command %d' % i)
+                latencies.append(loop.time() - start)
+
+        await asyncio.gather(*[worker(count // concurrency)
+                               for i in range(concurrency)])
+        pool.close()
+        return latencies
+
+    timing, latencies = await measure_async(run)
+    return report('RCON %d concurrent (pipelined)' % concurrency,
+                  len(latencies), timing, unit='cmds', latencies=latencies)
+
+
+async def forwarding(loop, server, count):
+    async def run():
+        arrived = {}
+
+        def handler(command):
+            now = loop.time()
+            for line in command.splitlines():
+                arrived[line] = now
+            return ''
+
+        server.handler = handler
+        pool = RconPool(server.host, server.port, server.password.decode(),
+                        loop=loop, pipelined=True)
+        forwarder = RconForwarder(
+            loop, pool.exec_command, lambda *args, **kwargs: None,
+            logging.getLogger('bench'),
+            window=float(DEFAULT_CONFIG['rcon_batch_window']),
+            max_batch=int(DEFAULT_CONFIG['rcon_batch_size']),
+            max_size=count)
+
+        sent = {}
+        for i in range(count):
+            text = 'nick: message %d' % i
+            sent[text] = loop.time()
+            forwarder.put_nowait('chat', '#factorio', text)
+        while len(arrived) < count:
+            await asyncio.sleep(0.01)
+
+        forwarder.task.cancel()
+        pool.close()
+        server.handler = lambda command: ''
+        return [arrived[text] - sent[text] for text in sent]
+
+    timing, latencies = await measure_async(run)
+    return report('IRC -> RCON burst', count, timing, unit='msgs',
+                  latencies=latencies)
+
+
+async def run(loop, count):
+    server = await FakeRconServer(loop=loop).start()
+    try:
+        return [
+            await sequential(loop, server, count, pipelined=False),
+            await sequential(loop, server, count, pipelined=True),
+            await concurrent(loop, server, count, 16),
+            await forwarding(loop, server, min(count, 200)),
+        ]
+    finally:
+        server.close()
+
+
+def bench(loop, count):
+    return loop.run_until_complete(run(loop, count))
+
+
+def main(args=None):
+    args = parser(__doc__)
+    args.add_argument('--commands', type=int, default=2000)
+    args = args.parse_args(args)
+    bench(asyncio.get_event_loop(), args.commands)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Log reader tail throughput
+
+The log is written to a file (or a pipe) while the reader follows it,
+and the time until the last line reaches the callback (through a
+LineQueue with the default settings) is measured.
+"""
+
+import os
+import asyncio
+import logging
+import tempfile
+
+from factoirc import readers
+from factoirc.line_queue import LineQueue
+
+from .common import measure_async, report
+from .corpus import corpus
+from .cli import parser
+
+
+CHUNK_SIZE = 16 * 1024
+
+
+async def follow(loop, reader_factory, write, lines):
+    data = memoryview(''.join(line + '\n' for line in lines).encode('utf-8'))
+    count = len(lines)
+
+    async def run():
+        received = []
+        done = loop.create_future()
+
+        async def callback(line):
+            received.append(line)
+            if len(received) == count and not done.done():
+                done.set_result(None)
+
+        queue = LineQueue(loop, callback, logging.getLogger('bench'))
+        reader = reader_factory(queue)
+
+        # Write in chunks, like a busy server would
+        pos = 0
+        while pos < len(data):
+            try:
+                pos += write(data[pos:pos + CHUNK_SIZE])
+            except BlockingIOError:
+                pass
+            await asyncio.sleep(0)
+        await done
+
+        reader.task.cancel()
+        queue.close()
+
+    timing, _ = await measure_async(run)
+    return timing
+
+
+def bench(loop, lines):
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'console.log')
+        open(path, 'wb').close()
+
+        with open(path, 'ab', buffering=0) as f:
+            measure = loop.run_until_complete(follow(
+                loop,
+                lambda queue: readers.FileLogReader(loop, queue, path),
+                f.write, lines))
+        results.append(report('FileLogReader', len(lines), measure))
+
+    rfd, wfd = os.pipe()
+    os.set_blocking(wfd, False)
+    stream = os.fdopen(rfd, 'rb')
+    try:
+        measure = loop.run_until_complete(follow(
+            loop,
+            lambda queue: readers.StreamLogReader(stream, loop, queue),
+            lambda data: os.write(wfd, data), lines))
+    finally:
+        os.close(wfd)
+        stream.close()
+    results.append(report('StreamLogReader (pipe)', len(lines), measure))
+
+    return results
+
+
+def main(args=None):
+    args = parser(__doc__).parse_args(args)
+    bench(asyncio.get_event_loop(), corpus(args.log, args.lines))
+
+
+if __name__ == '__main__':
+    main()
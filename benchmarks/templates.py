@@ -0,0 +1,41 @@
+"""Forwarding template rendering throughput (what format_action does)"""
+
+from factoirc import DEFAULT_FORWARDING, FactoIRC
+from factoirc.irc_colors import IRCColors
+from factoirc.templates import ForwardingTemplates
+
+from .common import measure, report
+from .cli import parser
+
+
+GAME_FORWARDING = dict(
+    DEFAULT_FORWARDING['game'],
+    chat='{c.boldBlue}{username}{c.boldDefault}: {message}',
+    kick='{B}{username}{B} was kicked by {by}. Reason: {reason}.',
+)
+
+
+def bench(count):
+    irc = ForwardingTemplates(DEFAULT_FORWARDING['irc'])
+    game = ForwardingTemplates(
+        GAME_FORWARDING, dict(FactoIRC.FORMAT_ALIASES, c=IRCColors))
+
+    def render():
+        for i in range(count):
+            irc.format('chat', channel='#factorio', nick='nick',
+                       message='hello there')
+            game.format('chat', username='player', message='hello there')
+            game.format('kick', username='player', by='admin', reason='')
+
+    timing, _ = measure(render)
+    return report('ForwardingTemplates.format', count * 3, timing,
+                  unit='msgs')
+
+
+def main(args=None):
+    args = parser(__doc__).parse_args(args)
+    bench(args.lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,24 +2,26 @@
 
 __version__ = '0.6'
 
-import re
+import time
 import asyncio
 import logging
+import collections
 
 import irc3
 
 from irc3.utils import as_list, as_channel
 from irc3.plugins.command import command
 
-from . import readers
+from . import sinks
 from .utils import catch
-from .rcon import RconConnection
 from .irc_colors import IRCColors
-from .log_parser import LogParser
+from .forwarding import IrcBroadcaster
+from .templates import ForwardingTemplates
+from .metrics import Metrics
+from .server import FactorioServer
+from .relay import Route
 
 
-ONLINE_RE = re.compile(r'\s*(.*?)\s+\(online\)')
-
 DEFAULT_CONFIG = dict(
     method='stdin',
     file='console.log',
@@ -28,6 +30,38 @@ DEFAULT_CONFIG = dict(
     rcon_host='localhost',
     rcon_port=27015,
     rcon_password='password',
+    log_queue_size=1000,
+    log_workers=1,
+    log_overflow='block',
+    max_peers=1000,
+    repeat_window=10,
+    repeat_max=3,
+    repeat_max_keys=10000,
+    players_ttl=60,
+    rcon_pool_size=1,
+    rcon_pipelining=True,
+    rcon_idle_check=30,
+    rcon_backoff_max=30,
+    rcon_max_response_size=1024 * 1024,
+    rcon_batch_window=0.1,
+    rcon_batch_size=10,
+    rcon_queue_size=100,
+    rcon_merge_threshold=3,
+    rcon_breaker_threshold=3,
+    rcon_probe_interval=1,
+    rcon_spool_size=100,
+    rcon_spool_max_age=300,
+    irc_rate=1,
+    irc_burst=4,
+    irc_channel_rate=1,
+    irc_channel_burst=4,
+    irc_queue_size=100,
+    irc_max_length=400,
+    metrics_host='localhost',
+    metrics_port=0,
+    event_batch_size=100,
+    event_flush_interval=1,
+    event_buffer_size=10000,
 )
 
 DEFAULT_FORWARDING = dict(
@@ -40,6 +74,9 @@ DEFAULT_FORWARDING = dict(
         kick='{nick} was kicked off {channel} by {by} ({reason})',
         quit='{nick} quit {channel} ({reason}).',
         newnick='{nick} renamed to {newnick}',
+        massjoin='{count} users joined {channel}.',
+        massleave='{count} users left {channel}.',
+        massquit='{count} users quit {channel} ({reason}).',
         default_reason='unspecified',
     ),
     game=dict(
@@ -47,10 +84,20 @@ DEFAULT_FORWARDING = dict(
         prefix='(factorio)',
         chat='{username}: {message}',
         default='{username} {message}',
+        overflow='{count} log lines were skipped.',
+        repeated='{username}: last message repeated {count} times.',
         default_reason='unspecified',
     )
 )
 
+DEFAULT_RELAY = dict(
+    actions='chat',
+    prefix='[{server}]',
+    chat='{username}: {message}',
+    default='{username} {message}',
+    default_reason='unspecified',
+)
+
 
 @irc3.plugin
 class FactoIRC:
@@ -65,34 +112,68 @@ class FactoIRC:
         C=IRCColors.color,
     )
 
+    DEFAULT_SERVER = 'default'
+
     def __init__(self, bot):
         self.bot = bot
-        self.reader = None
 
         self.log = logging.getLogger('irc3.%s' % __name__)
-        self.log_parser = LogParser(self.log)
-
         self.config = dict(DEFAULT_CONFIG)
         self.config.update(bot.config.get(self.__class__.__module__, {}))
         self.log.debug('config: %r', self.config)
 
-        autojoins = self.bot.config.get('autojoins')
-        self.channels = [
-            as_channel(c)
-            for c in as_list(
-                self.config.get('channels', autojoins)
-            )
-        ]
-
-        self.actions = {}
+        self.metrics = Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+
+        self.broadcaster = IrcBroadcaster(
+            self.bot.loop, self.send_privmsg, self.log,
+            targmax=self.privmsg_targmax,
+            rate=float(self.config['irc_rate']),
+            burst=int(self.config['irc_burst']),
+            channel_rate=float(self.config['irc_channel_rate']),
+            channel_burst=int(self.config['irc_channel_burst']),
+            max_size=int(self.config['irc_queue_size']),
+            max_length=int(self.config['irc_max_length']),
+            encoding=self.bot.encoding,
+            backlog=self.irc_backlog,
+        )
 
-        for act_type in DEFAULT_FORWARDING:
-            config = dict(DEFAULT_FORWARDING[act_type])
+        # Each name in `servers` has a [factoirc.<name>] section overriding
+        # the [factoirc] settings. Without it, [factoirc] describes the only
+        # server.
+        self.servers = collections.OrderedDict()
+        for name in as_list(self.config.get('servers')) or [None]:
+            server = self.create_server(name)
+            self.servers[server.name] = server
+
+        self.channels = []
+        for server in self.servers.values():
+            self.channels.extend(c for c in server.channels
+                                 if c not in self.channels)
+
+        self.log.debug('servers: %r', list(self.servers.values()))
+
+        # Game events relayed between servers, each route has a
+        # [factoirc.relay.<name>] section
+        prefixes = [server.actions['irc'].prefix
+                    for server in self.servers.values()]
+        self.routes = []
+        for name in as_list(self.config.get('relays')):
+            config = dict(DEFAULT_RELAY)
             config.update(self.bot.config.get(
-                '%s.%s-forwarding' % (self.__class__.__module__, act_type)))
-            self.actions[act_type] = config
+                '%s.relay.%s' % (self.__class__.__module__, name), {}))
+            self.routes.append(Route.from_config(
+                name, config, self.servers, prefixes=prefixes))
+
+        self.log.debug('routes: %r', self.routes)
 
-        self.log.debug('actions: %r', self.actions)
+        self.sinks = []
+        for url in as_list(self.config.get('event_sinks')):
+            self.add_sink(sinks.new(
+                url, self.bot.loop, log=self.log,
+                batch_size=int(self.config['event_batch_size']),
+                interval=float(self.config['event_flush_interval']),
+                max_size=int(self.config['event_buffer_size'])))
 
         # on_quit needs to be executed before the userlist plugin sees
         # the QUIT event so that we can check which channels the user
@@ -101,97 +182,163 @@ class FactoIRC:
             irc3.event(irc3.rfc.QUIT, self.on_quit),
             insert=True
         )
-        self.log.info('FactoIRC %s loaded.' % __version__)
+        if int(self.config['metrics_port']):
+            self.bot.loop.create_task(self.metrics.serve(
+                self.config['metrics_host'], int(self.config['metrics_port'])))
 
-    def format_action(self, act_type, action, **kwargs):
-        config = self.actions[act_type]
-        actions = set(as_list(config['actions']))
+        self.log.info('FactoIRC %s loaded.', __version__)
 
-        if not {action, 'all'} & actions:
-            return
+    def create_server(self, name=None):
+        module = self.__class__.__module__
 
-        values = {k[8:]: v
-                  for k, v in config.items()
-                  if k.startswith('default_')}
+        config = dict(self.config)
+        if name:
+            config.update(self.bot.config.get('%s.%s' % (module, name), {}))
 
-        values.update({k: v
-                       for k, v in kwargs.items()
-                       if k not in values or v})
+        autojoins = self.bot.config.get('autojoins')
+        channels = [
+            as_channel(c)
+            for c in as_list(
+                config.get('channels', autojoins)
+            )
+        ]
 
-        fmt = config.get(action, config.get('default', ''))
-        if not fmt:
-            raise ValueError('Undefined action: %s' % action)
-        if config.get('prefix'):
-            fmt = config['prefix'] + ' ' + fmt
+        # Color codes are only available for Factorio -> IRC messages
+        constants = dict(
+            irc={},
+            game=dict(self.FORMAT_ALIASES, c=IRCColors),
+        )
 
-        return fmt.format(**values)
+        actions = {}
 
-    async def irc_action(self, action, channel, simulate=False, **kwargs):
-        if channel not in self.channels:
+        for act_type in DEFAULT_FORWARDING:
+            section = '%s-forwarding' % act_type
+            forwarding = dict(DEFAULT_FORWARDING[act_type])
+            forwarding.update(self.bot.config.get(
+                '%s.%s' % (module, section)))
+            if name:
+                forwarding.update(self.bot.config.get(
+                    '%s.%s.%s' % (module, name, section), {}))
+            actions[act_type] = ForwardingTemplates(
+                forwarding, constants[act_type])
+
+        self.log.debug('%s actions: %r', name, actions)
+
+        return FactorioServer(
+            self, name or self.DEFAULT_SERVER, config, channels, actions)
+
+    def servers_for(self, target):
+        """Return the servers bridged with `target` (all of them for a
+        private message)"""
+
+        if not getattr(target, 'is_channel', False):
+            return list(self.servers.values())
+        return [server
+                for server in self.servers.values()
+                if target in server.channels]
+
+    def select_server(self, target, args):
+        """Return the server a command applies to"""
+
+        name = args.get('--server')
+        if name:
+            try:
+                return self.servers[name]
+            except KeyError:
+                raise ValueError('Unknown server: %s' % name)
+
+        servers = self.servers_for(target)
+        if len(servers) != 1:
+            raise ValueError('Please choose a server with --server (%s)' %
+                             ', '.join(self.servers))
+        return servers[0]
+
+    def route(self, server, event):
+        """Relay a game event of `server` to the other servers"""
+
+        for route in self.routes:
+            try:
+                route.relay(server, **event)
+            except Exception:
+                server.log.exception('Unable to relay %s with %s',
+                                     event.get('action'), route.name)
+
+    def add_sink(self, sink):
+        """Send the parsed game events to `sink`
+
+        A sink can be any object with a `put(event)` method. It's called
+        for each event, a dict with the fields parsed from the log, the
+        `server` name and the time it was `received`. It must not block,
+        see EventSink.
+        """
+
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def emit(self, server, event):
+        """Send a game event of `server` to the sinks"""
+
+        if not self.sinks:
             return
-        msg = self.format_action('irc', action, channel=channel, **kwargs)
-        if simulate:
-            return msg
-        if msg:
-            await self.do_rcon(msg)
-
-    async def game_action(self, action, simulate=False, **kwargs):
-        msg = self.format_action(
-            'game', action, c=IRCColors, **self.FORMAT_ALIASES, **kwargs)
-        if msg.strip().startswith('/'):
-            raise ValueError("Formatted message can't begin with /")
-        if simulate:
-            return msg
-        if msg:
-            self.broadcast(msg)
+
+        event = dict(event, server=server.name, received=time.time())
+        for sink in self.sinks:
+            try:
+                sink.put(event)
+            except Exception:
+                server.log.exception('Unable to send event to %r', sink)
+
+    async def each_server(self, method, *args, **kwargs):
+        """Call a coroutine method of every server concurrently
+
+        A failure on a server is logged and doesn't affect the other ones.
+        """
+
+        servers = list(self.servers.values())
+        results = await asyncio.gather(
+            *[getattr(server, method)(*args, **kwargs) for server in servers],
+            return_exceptions=True)
+
+        for server, result in zip(servers, results):
+            if isinstance(result, Exception):
+                server.log.error('%s failed', method, exc_info=result)
 
     @irc3.event(irc3.rfc.JOIN)
     async def on_join(self, mask, channel, **kwargs):
-        if not self.actions['irc'] or self.actions['irc'] == {'none'}:
-            # Nothing to forward, don't bother to create a reader
-            return
-
         if mask.nick == self.bot.nick:
-            if not self.reader:
-                self.reader = readers.new(
-                    self.config['method'], self.bot.loop,
-                    self.log_line, **self.config)
+            for server in self.servers.values():
+                server.start_reader()
             return
 
-        await self.irc_action('join', channel=channel, nick=mask.nick)
+        await self.each_server(
+            'irc_action', 'join', channel=channel, nick=mask.nick)
 
     @irc3.event(irc3.rfc.PART)
     async def on_part(self, mask, channel, data, **kwargs):
-        await self.irc_action(
-            'leave', channel=channel, nick=mask.nick,
+        await self.each_server(
+            'irc_action', 'leave', channel=channel, nick=mask.nick,
             reason=data
         )
 
     @irc3.event(irc3.rfc.KICK)
     async def on_kick(self, mask, channel, target, data, **kwargs):
-        await self.irc_action(
-            'kick', channel=channel, nick=target, by=mask.nick,
+        await self.each_server(
+            'irc_action', 'kick', channel=channel, nick=target, by=mask.nick,
             reason=data
         )
 
     def on_quit(self, mask, data, **kwargs):
-        for channel in self.channels:
-            if mask.nick in self.bot.channels.get(channel, []):
-                self.bot.loop.create_task(self.irc_action(
-                    'quit', channel=channel, nick=mask.nick,
-                    reason=data
-                ))
-                return
+        for server in self.servers.values():
+            try:
+                server.on_quit(mask.nick, data)
+            except Exception:
+                server.log.exception('on_quit failed')
 
     @irc3.event(irc3.rfc.NEW_NICK)
     async def on_nick(self, nick, new_nick, **kwargs):
-        for channel in self.channels:
-            if new_nick in self.bot.channels.get(channel, []):
-                await self.irc_action(
-                    'newnick', channel=channel, nick=nick.nick,
-                    newnick=new_nick
-                )
-                return
+        await self.each_server('on_nick', nick.nick, new_nick)
 
     @irc3.event(irc3.rfc.PRIVMSG)
     async def on_privmsg(self, mask, target, data, **kwargs):
@@ -200,43 +347,55 @@ class FactoIRC:
         if data.startswith(self.bot.config.get('cmd', '!')):
             return
 
-        await self.irc_action(
-            'chat', channel=target, nick=mask.nick, message=data)
+        await self.each_server(
+            'irc_action', 'chat', channel=target, nick=mask.nick,
+            message=data)
 
-    def broadcast(self, msg):
-        self.log.debug('broadcast: %s', msg)
+    def send_privmsg(self, target, msg):
+        # Through the flood control queue of irc3, which the command
+        # replies go through too
+        self.bot.privmsg(target, msg)
 
-        for channel in self.channels:
-            self.bot.privmsg(channel, msg)
+    def irc_backlog(self):
+        """Return how many lines are waiting in irc3's flood control queue"""
 
-    async def log_line(self, line):
-        self.log.debug('log line: %s', line)
-        result = self.log_parser.parse_line(line)
-        if not result:
-            return
-        self.log.debug('log parsed: %r', result)
-        await self.game_action(**result)
+        return self.bot.queue.qsize() if self.bot.queue else 0
 
-    async def do_rcon(self, text):
-        host = self.config['rcon_host']
-        port = self.config['rcon_port']
-        password = self.config['rcon_password']
+    def privmsg_targmax(self):
+        """Return how many targets a PRIVMSG can have (TARGMAX ISUPPORT)"""
 
-        self.log.debug('RCON request: %s', text)
+        targmax = self.bot.server_config.get('TARGMAX')
+        if not isinstance(targmax, str):
+            return 1
 
-        conn = RconConnection(host, int(port), password, loop=self.bot.loop)
-        try:
-            result = (await asyncio.wait_for(
-                conn.exec_command(text),
-                timeout=float(self.config['rcon_timeout']),
-                loop=self.bot.loop,
-            )).splitlines()
-        finally:
-            conn.close()
+        for limit in targmax.split(','):
+            cmd, _, limit = limit.partition(':')
+            if cmd == 'PRIVMSG':
+                return int(limit) if limit else len(self.channels)
 
-        self.log.debug('RCON response: %r', result)
+        return 1
 
-        return result
+    def collect_metrics(self):
+        """Return the statistics tracked by the plugin components"""
+
+        samples = [
+            ('irc_queue_size', {}, len(self.broadcaster)),
+        ]
+        samples.extend(('irc_messages_%s_total' % name, {}, value)
+                       for name, value in self.broadcaster.stats.items())
+        for route in self.routes:
+            samples.extend(('relay_%s_total' % name, dict(route=route.name),
+                            value)
+                           for name, value in route.stats.items())
+        for sink in self.sinks:
+            if not isinstance(sink, sinks.EventSink):
+                continue
+            samples.append(('events_queue_size', dict(sink=repr(sink)),
+                            len(sink)))
+            samples.extend(('events_%s_total' % name, dict(sink=repr(sink)),
+                            value)
+                           for name, value in sink.stats.items())
+        return samples
 
     @command(permission='rcon', use_shlex=False)
     @catch
@@ -244,10 +403,11 @@ class FactoIRC:
         '''
             Execute an RCON command
 
-            %%rcon <command>...
+            %%rcon [--server=<name>] <command>...
         '''
+        server = self.select_server(target, args)
         cmd = ' '.join(args['<command>'])
-        return await self.do_rcon(cmd)
+        return await server.do_rcon(cmd, multi_packet=True)
 
     @command(permission='players')
     @catch
@@ -255,18 +415,68 @@ class FactoIRC:
         '''
             Show connected players.
 
-            %%players
+            %%players [--server=<name>]
+        '''
+        if args['--server']:
+            servers = [self.select_server(target, args)]
+        else:
+            servers = self.servers_for(target)
+
+        result = []
+        for server in servers:
+            players = await server.roster.get()
+
+            if players:
+                msg = 'Connected players (%d): %s' % (
+                        len(players), ', '.join(players))
+            else:
+                msg = 'No one is connected'
+
+            if len(self.servers) > 1:
+                msg = '%s: %s' % (server.name, msg)
+            result.append(msg)
+
+        return result
+
+    @command(permission='stats')
+    @catch
+    async def stats(self, mask, target, args):
         '''
-        players = await self.do_rcon('/players')
-        players = [m.group(1)
-                   for m in map(ONLINE_RE.match, players)
-                   if m]
-
-        if players:
-            return 'Connected players (%d): %s' % (
-                    len(players), ', '.join(players))
+            Show statistics about the bridge.
+
+            %%stats [--server=<name>]
+        '''
+        if args['--server']:
+            servers = [self.select_server(target, args)]
         else:
-            return 'No one is connected'
+            servers = self.servers_for(target)
+
+        result = []
+        for server in servers:
+            lines = server.stats()
+            if len(self.servers) > 1:
+                lines = ['%s: %s' % (server.name, line) for line in lines]
+            result.extend(lines)
+
+        broadcaster = self.broadcaster.stats
+        result.append(
+            'Game -> IRC: %d queued, %d sent in %d messages, %d dropped' % (
+                len(self.broadcaster), broadcaster['sent'],
+                broadcaster['privmsgs'], broadcaster['dropped']))
+        if self.routes:
+            result.append('Relays: %s' % ', '.join(
+                '%s: %d relayed, %d filtered, %d loops, %d dropped' % (
+                    route.name, route.stats['relayed'],
+                    route.stats['filtered'], route.stats['loops'],
+                    route.stats['dropped'])
+                for route in self.routes))
+        for sink in self.sinks:
+            if isinstance(sink, sinks.EventSink):
+                result.append(
+                    'Events to %r: %d queued, %d written, %d dropped, '
+                    '%d lost' % (sink, len(sink), sink.stats['written'],
+                                 sink.stats['dropped'], sink.stats['lost']))
+        return result
 
     @command(permissions='admin')
     @catch
@@ -275,8 +485,10 @@ class FactoIRC:
             Simulate actions (mostly for testing messages format), eg:
             !test_action game kick username=foo by=bar reason=baz
 
-            %%test_action (irc | game) <action> <name>=<value>...
+            %%test_action [--server=<name>] irc <action> <name>=<value>...
+            %%test_action [--server=<name>] game <action> <name>=<value>...
         '''
+        server = self.select_server(target, args)
 
         values = dict(simulate=True)
         if target.is_channel:
@@ -285,9 +497,9 @@ class FactoIRC:
         values.update(arg.split('=', 2) for arg in args['<name>=<value>'])
 
         if args['irc']:
-            res = await self.irc_action(args['<action>'], **values)
+            res = await server.irc_action(args['<action>'], **values)
         else:
-            res = await self.game_action(args['<action>'], **values)
+            res = await server.game_action(args['<action>'], **values)
 
         if values.get('simulate'):
             return res
@@ -0,0 +1,391 @@
+import asyncio
+import itertools
+import collections
+
+__all__ = ['RconForwarder', 'IrcBroadcaster']
+
+
+Message = collections.namedtuple('Message', 'action channel text values')
+
+
+class RconForwarder:
+    """Bounded queue forwarding IRC messages to the game over RCON.
+
+    Messages arriving within `window` seconds of each other are sent as a
+    single RCON command (one message per line, up to `max_batch` lines).
+    Batches are sent one at a time, in order.
+
+    When the same `mergeable` action (eg, quit) happens at least
+    `merge_threshold` times on a channel within the queued messages, those
+    messages are replaced by a single summary returned by
+    `summarize(action, channel, count, **common_values)`.
+
+    At most `max_size` messages are queued. Beyond that, `put()` waits for
+    some room, except for mergeable messages which are only counted
+    (and reported in the next summary) so that join/quit storms can't
+    fill the queue.
+
+    With a `spool` (see Spool), batches that couldn't be sent are kept
+    there, and so are new ones while `available()` is false. Spooled
+    messages are sent first, in batches, when the next message is queued
+    or when `resume()` is called.
+    """
+
+    task = None
+
+    def __init__(self, loop, send, summarize, log, window=0.1, max_size=100,
+                 max_batch=10, merge_threshold=3,
+                 mergeable=('join', 'leave', 'quit'), spool=None,
+                 available=lambda: True):
+        self.loop = loop
+        self.send = send
+        self.summarize = summarize
+        self.log = log
+        self.window = window
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.merge_threshold = merge_threshold
+        self.mergeable = set(mergeable)
+        self.spool = spool
+        self.available = available
+
+        self.queue = collections.deque()
+        self.dropped = collections.Counter()
+        self.stats = collections.Counter()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+        self.task = loop.create_task(self.run())
+
+    def __del__(self):
+        if self.task:
+            self.task.cancel()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def full(self):
+        return len(self.queue) >= self.max_size
+
+    async def put(self, action, channel, text, **values):
+        """Queue a message, waiting for some room if the queue is full"""
+
+        while self.full() and action not in self.mergeable:
+            self.not_full.clear()
+            await self.not_full.wait()
+
+        self.put_nowait(action, channel, text, **values)
+
+    def put_nowait(self, action, channel, text, **values):
+        """Queue a message without waiting
+
+        If the queue is full, the oldest mergeable message is dropped to
+        make room (it will still be counted in a summary). Return False if
+        the message itself had to be dropped.
+        """
+
+        if self.full():
+            if action in self.mergeable:
+                self.dropped[action, channel] += 1
+                self.not_empty.set()
+                return False
+
+            for msg in self.queue:
+                if msg.action in self.mergeable:
+                    self.queue.remove(msg)
+                    self.dropped[msg.action, msg.channel] += 1
+                    break
+            else:
+                self.log.warning('RCON queue full, dropping: %s', text)
+                self.stats['dropped'] += 1
+                return False
+
+        self.queue.append(Message(action, channel, text, values))
+        self.stats['queued'] += 1
+        self.not_empty.set()
+        return True
+
+    def take_batch(self):
+        """Remove the next batch from the queue and return its lines"""
+
+        counts = collections.Counter(self.dropped)
+        for msg in self.queue:
+            if msg.action in self.mergeable:
+                counts[msg.action, msg.channel] += 1
+
+        merged = {key for key, count in counts.items()
+                  if count >= self.merge_threshold}
+        merged.update(self.dropped)
+        self.dropped.clear()
+        self.stats['merged'] += sum(counts[key] for key in merged)
+
+        # Values shared by all the merged messages, eg a netsplit reason
+        common = {}
+        for msg in self.queue:
+            key = msg.action, msg.channel
+            if key not in merged:
+                continue
+            if key not in common:
+                common[key] = dict(msg.values)
+                continue
+            common[key] = {k: v
+                           for k, v in common[key].items()
+                           if msg.values.get(k) == v}
+
+        lines = []
+        summarized = set()
+        while self.queue and len(lines) < self.max_batch:
+            msg = self.queue.popleft()
+            key = msg.action, msg.channel
+            if key not in merged:
+                lines.append(msg.text)
+            elif key not in summarized:
+                summarized.add(key)
+                lines.append(self.summarize(
+                    msg.action, msg.channel, counts[key],
+                    **common.get(key, {})))
+
+        # Summaries also account for the merged messages left in the queue
+        # and for the ones that were dropped
+        self.queue = collections.deque(
+            msg for msg in self.queue
+            if (msg.action, msg.channel) not in merged)
+
+        for key in sorted(merged - summarized):
+            lines.append(self.summarize(
+                key[0], key[1], counts[key], **common.get(key, {})))
+
+        return [line for line in lines if line]
+
+    def resume(self):
+        """Send the spooled messages, eg when the game is available again"""
+
+        if self.spool:
+            self.not_empty.set()
+
+    async def forward(self, lines):
+        """Send lines to the game, return whether it succeeded"""
+
+        try:
+            await self.send('\n'.join(lines))
+        except Exception as ex:
+            self.stats['errors'] += 1
+            if self.spool is not None:
+                self.log.warning('Unable to forward messages to the game, '
+                                 'spooling them: %r', ex)
+            else:
+                self.log.exception('Unable to forward messages to the game')
+            return False
+
+        self.stats['batches'] += 1
+        self.stats['sent'] += len(lines)
+        return True
+
+    async def drain_spool(self):
+        while self.spool and self.available():
+            lines = self.spool.peek(self.max_batch)
+            if not lines:
+                break
+            if not await self.forward(lines):
+                break
+            self.spool.pop(len(lines))
+            if self.window:
+                await asyncio.sleep(self.window)
+
+    async def run(self):
+        while True:
+            await self.not_empty.wait()
+            if self.window:
+                await asyncio.sleep(self.window)
+
+            lines = self.take_batch()
+            if not self.queue and not self.dropped:
+                self.not_empty.clear()
+            if not self.full():
+                self.not_full.set()
+
+            if self.spool is None:
+                if lines:
+                    await self.forward(lines)
+                continue
+
+            # Spooled messages go first, to keep them in order
+            if self.spool or not self.available():
+                self.spool.extend(lines)
+                await self.drain_spool()
+            elif lines and not await self.forward(lines):
+                self.spool.extend(lines)
+
+
+class TokenBucket:
+    """Allow `rate` events per second on average, with bursts of `burst`"""
+
+    def __init__(self, loop, rate, burst):
+        self.loop = loop
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = loop.time()
+
+    def _refill(self):
+        now = self.loop.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Return the number of seconds until an event is allowed"""
+
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class IrcBroadcaster:
+    """Rate-limited sending of game messages to IRC channels.
+
+    Messages are paced by a token bucket for the whole network and one
+    for each channel. As long as tokens are available, messages are sent
+    right away. Otherwise they're queued (up to `max_size` per channel,
+    the oldest being dropped) and, once the limits allow it, consecutive
+    queued lines are merged into a single message of at most `max_length`
+    bytes, separated by `separator`.
+
+    A message going to several channels is sent once to all of them
+    (grouped by `targmax()` channels at most, see the TARGMAX ISUPPORT
+    token).
+
+    Other messages (eg, command replies) may share the IRC client's own
+    flood control queue: nothing is sent while `backlog()` says that queue
+    isn't empty, so that the queued lines keep being merged meanwhile.
+    """
+
+    task = None
+
+    def __init__(self, loop, send, log, targmax=lambda: 1, rate=1, burst=4,
+                 channel_rate=1, channel_burst=4, max_size=100,
+                 max_length=400, separator=' | ', encoding='utf-8',
+                 backlog=lambda: 0):
+        self.loop = loop
+        self.send = send
+        self.log = log
+        self.targmax = targmax
+        self.backlog = backlog
+        self.max_size = max_size
+        self.max_length = max_length
+        self.separator = separator
+        self.encoding = encoding
+
+        self.network = TokenBucket(loop, rate, burst)
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.channels = collections.OrderedDict()  # name -> (bucket, lines)
+        self.stats = collections.Counter()
+
+        self.not_empty = asyncio.Event()
+        self.task = loop.create_task(self.run())
+
+    def __del__(self):
+        if self.task:
+            self.task.cancel()
+
+    def broadcast(self, msg, channels):
+        for channel in channels:
+            if channel not in self.channels:
+                self.channels[channel] = (
+                    TokenBucket(self.loop, self.channel_rate,
+                                self.channel_burst),
+                    collections.deque())
+
+            bucket, lines = self.channels[channel]
+            if len(lines) >= self.max_size:
+                self.log.warning('IRC queue full for %s, dropping: %s',
+                                 channel, lines.popleft())
+                self.stats['dropped'] += 1
+            lines.append(msg)
+            self.stats['queued'] += 1
+
+        if self.flush() is not None:
+            self.not_empty.set()
+
+    def __len__(self):
+        return sum(len(lines) for bucket, lines in self.channels.values())
+
+    def _merge(self, lines):
+        """Return the text made from the first lines and how many it uses"""
+
+        text = lines[0]
+        size = len(text.encode(self.encoding))
+        sep_size = len(self.separator.encode(self.encoding))
+        count = 1
+
+        for line in itertools.islice(lines, 1, None):
+            size += sep_size + len(line.encode(self.encoding))
+            if size > self.max_length:
+                break
+            text += self.separator + line
+            count += 1
+
+        return text, count
+
+    def flush(self):
+        """Send what the limits allow
+
+        Return the delay before more can be sent, or None if all the
+        queues are empty.
+        """
+
+        if self.backlog():
+            if not len(self):
+                return None
+            return 1 / self.network.rate
+
+        while True:
+            next_delay = None
+            ready = collections.OrderedDict()
+            for channel, (bucket, lines) in self.channels.items():
+                if not lines:
+                    continue
+                delay = max(bucket.delay(), self.network.delay())
+                if delay:
+                    if next_delay is None or delay < next_delay:
+                        next_delay = delay
+                    continue
+                ready[channel] = self._merge(lines)
+
+            if not ready:
+                return next_delay
+
+            # Send the first ready message, along with the same one
+            # for as many other channels as allowed
+            text, count = next(iter(ready.values()))
+            targets = [channel
+                       for channel, merged in ready.items()
+                       if merged == (text, count)]
+            del targets[max(self.targmax(), 1):]
+
+            self.network.take()
+            for channel in targets:
+                bucket, lines = self.channels[channel]
+                bucket.take()
+                for i in range(count):
+                    lines.popleft()
+
+            self.stats['privmsgs'] += 1
+            self.stats['sent'] += count * len(targets)
+            self.send(','.join(targets), text)
+
+    async def run(self):
+        while True:
+            await self.not_empty.wait()
+            delay = self.flush()
+            if delay is None:
+                self.not_empty.clear()
+            else:
+                await asyncio.sleep(delay)
@@ -45,8 +45,37 @@ class IRCColors:
         reset='\x0F'
     )
 
+    # Invalid tags are remembered too, up to this many
+    MAX_INVALID = 256
+
+    def __init__(self):
+        # Resolved codes by lowercase tags. Valid tags are finite, so this
+        # can't grow indefinitely.
+        self.codes = {}
+        self.invalid = set()
+
     def __getattr__(self, tags):
         cur_tags = tags.lower()
+        try:
+            return self.codes[cur_tags]
+        except KeyError:
+            pass
+
+        if cur_tags in self.invalid:
+            raise AttributeError(tags)
+
+        result = self.resolve(cur_tags)
+        if result is None:
+            if len(self.invalid) < self.MAX_INVALID:
+                self.invalid.add(cur_tags)
+            raise AttributeError(tags)
+
+        self.codes[cur_tags] = result
+        return result
+
+    def resolve(self, cur_tags):
+        """Return the control codes for lowercase tags, or None"""
+
         result = ''
 
         for code_name, code in self.CONTROL_CODES.items():
@@ -68,7 +97,7 @@ class IRCColors:
                     break
 
         if cur_tags:
-            raise AttributeError(tags)
+            return None
 
         return result
 
@@ -0,0 +1,148 @@
+import asyncio
+import collections
+
+__all__ = ['LineQueue']
+
+
+class LineQueue:
+    """Bounded queue between the log readers and the line callback.
+
+    Lines are passed to `callback(line)` by `workers` tasks. Lines coming
+    from the same source (eg, a reader) are always handled one at a time,
+    in the order they were read, while different sources are handled
+    concurrently.
+
+    At most `max_size` lines are queued. What happens beyond that depends
+    on `policy`:
+
+    - block: the readers stop reading until there's room again (lines
+      are never lost, the backlog stays in the log or the pipe)
+    - drop: the oldest line of the source with the most queued lines is
+      dropped
+    - summarize: like drop, then `on_overflow(source, count)` is called
+      before handling the next line of that source, to report how many
+      lines were dropped.
+
+    A line can be queued with an `on_done()` callback, called once the
+    line has been handled (but not if it's dropped), eg to remember how
+    far the log has been forwarded.
+    """
+
+    POLICIES = ('block', 'drop', 'summarize')
+
+    def __init__(self, loop, callback, log, workers=1, max_size=1000,
+                 policy='block', on_overflow=None):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % policy)
+
+        self.loop = loop
+        self.callback = callback
+        self.log = log
+        self.max_size = max_size
+        self.policy = policy
+        self.on_overflow = on_overflow
+
+        self.size = 0
+        self.sources = {}  # source -> deque of (line, on_done)
+        self.ready = collections.deque()  # sources with lines, not busy
+        self.busy = set()
+        self.dropped = collections.Counter()
+        self.stats = collections.Counter()
+
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+        self.tasks = [loop.create_task(self.run()) for i in range(workers)]
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def full(self):
+        return self.size >= self.max_size
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def put_nowait(self, source, line, on_done=None):
+        """Queue a line, dropping an older one if the queue is full
+
+        With the block policy, nothing is dropped: the queue can grow past
+        `max_size`, readers must wait for `wait_room()` before reading more.
+        """
+
+        if self.full() and self.policy != 'block':
+            victim = max(self.sources, key=lambda s: len(self.sources[s]))
+            self.sources[victim].popleft()
+            if not self.sources[victim] and victim not in self.busy:
+                self.ready.remove(victim)
+                del self.sources[victim]
+            self.size -= 1
+            self.dropped[victim] += 1
+            self.stats['dropped'] += 1
+
+        lines = self.sources.get(source)
+        if lines is None:
+            lines = self.sources[source] = collections.deque()
+        if not lines and source not in self.busy:
+            self.ready.append(source)
+        lines.append((line, on_done))
+        self.size += 1
+        self.stats['queued'] += 1
+        self.not_empty.set()
+
+    async def wait_room(self):
+        """Wait until the queue can accept more lines"""
+
+        while self.full() and self.policy == 'block':
+            self.not_full.clear()
+            await self.not_full.wait()
+
+    async def put(self, source, line, on_done=None):
+        await self.wait_room()
+        self.put_nowait(source, line, on_done)
+
+    async def handle(self, source, line):
+        count = self.dropped.pop(source, 0)
+        if count:
+            self.log.warning('Log queue full, %d lines dropped', count)
+            if self.policy == 'summarize' and self.on_overflow:
+                await self.on_overflow(source, count)
+
+        await self.callback(line)
+
+    async def run(self):
+        while True:
+            while not self.ready:
+                self.not_empty.clear()
+                await self.not_empty.wait()
+
+            source = self.ready.popleft()
+            lines = self.sources[source]
+            line, on_done = lines.popleft()
+            self.size -= 1
+            if not self.full():
+                self.not_full.set()
+
+            self.busy.add(source)
+            try:
+                await self.handle(source, line)
+                self.stats['handled'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+                self.log.exception('Unable to handle log line: %s', line)
+            finally:
+                self.busy.discard(source)
+                if lines:
+                    self.ready.append(source)
+                    self.not_empty.set()
+                else:
+                    del self.sources[source]
+
+            if on_done is not None:
+                on_done()
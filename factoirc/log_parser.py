@@ -1,6 +1,9 @@
 import re
+import datetime
+import collections
 
 LOG_PATTERN = r'\s*(?P<time>[\d.]+) (?P<level>Info|Verbose|Warning|Error) '
+LOG_RE = re.compile(LOG_PATTERN)
 JOIN_PART_RE = re.compile(
     LOG_PATTERN +
     r'[^ ]+ MapTick\(\d+\) processed Player(?P<action>Leave|Join)Game '
@@ -42,67 +45,209 @@ ACTIONS_RE = dict(
 )
 ACTIONS_RE = {k: re.compile(v) for k, v in ACTIONS_RE.items()}
 
+# Factorio >=0.13.10 console lines: the tag tells which pattern applies to
+# the rest of the line
+CONSOLE_RE = re.compile(TIMESTAMP + r'\s+\[(?P<tag>[A-Z]+)\]\s+')
+CHAT_MESSAGE_RE = re.compile(r'(?P<username>[^: ]+):\s+(?P<message>.*)')
+ACTION_MESSAGE_RE = re.compile(r'(?P<username>[^\s]+)\s+(?P<message>.*)')
+ACTION_TAGS = {'JOIN', 'LEAVE', 'KICK', 'BAN', 'COMMAND'}
+
+
+def line_timestamp(line):
+    """Return the clock and time in seconds of a log line, or None
+
+    The clock is 'date' for console lines, whose time is a UNIX timestamp
+    (in local time), and 'uptime' for the other log lines, whose time is
+    the server uptime. Both can be mixed in the same log.
+    """
+
+    m = CONSOLE_RE.match(line)
+    if m:
+        try:
+            return 'date', datetime.datetime.strptime(
+                '%s %s' % (m.group('date'), m.group('time')),
+                '%Y-%m-%d %H:%M:%S').timestamp()
+        except ValueError:
+            return None
+
+    m = LOG_RE.match(line)
+    if m:
+        try:
+            return 'uptime', float(m.group('time'))
+        except ValueError:
+            return None
+
+
+class PeerTable:
+    """Bounded mapping of peer IDs to usernames.
+
+    Entries are removed when the peer leaves the game. Entries for peers
+    that never do (eg, connections that fail before joining) are evicted,
+    least recently used first, once there are more than `max_size`.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.names = collections.OrderedDict()
+        self.added = 0
+        self.removed = 0
+        self.evicted = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.names
+
+    def __getitem__(self, peer_id):
+        try:
+            username = self.names[peer_id]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.names.move_to_end(peer_id)
+        return username
+
+    def __setitem__(self, peer_id, username):
+        if peer_id in self.names:
+            self.names.move_to_end(peer_id)
+        else:
+            self.added += 1
+        self.names[peer_id] = username
+
+        while len(self.names) > self.max_size:
+            self.names.popitem(last=False)
+            self.evicted += 1
+
+    def pop(self, peer_id, default=None):
+        if peer_id not in self.names:
+            return default
+        self.removed += 1
+        return self.names.pop(peer_id)
+
+    def stats(self):
+        return dict(size=len(self.names), max_size=self.max_size,
+                    added=self.added, removed=self.removed,
+                    evicted=self.evicted, misses=self.misses)
+
 
 class LogParser:
-    def __init__(self, logger):
+    """Extract game actions from Factorio log lines.
+
+    Each line is classified by its prefix first, so that only the pattern
+    that can apply to it is tried:
+        - Log lines (verbose output) start with an uptime and a level,
+          and only those mentioning a peer are parsed further.
+        - Console lines start with a timestamp and a tag telling whether
+          it's a chat message or another action.
+        - Anything else may be a chat message from Factorio <0.13.10.
+
+    Usernames are tracked by peer ID (see `PeerTable`) to report joins
+    and leaves.
+    """
+
+    def __init__(self, logger, max_peers=1000):
         self.logger = logger
-        self.peer_names = {}
+        self.peer_names = PeerTable(max_peers)
+        self.hits = collections.Counter()  # matches by pattern
 
     def parse_line(self, line):
-        for pattern in (CHAT_RE, ACTION_RE, JOIN_PART_RE, USERNAME_RE):
-            m = pattern.match(line)
-            if not m:
-                continue
-
-            result = m.groupdict()
-
-            if result.get('action'):
-                result['action'] = result['action'].lower()
-
-            self.logger.debug('regex match: %r', result)
-
-            if pattern == USERNAME_RE:
-                peer_id = result['peer_id']
-                username = result['username']
-                self.peer_names[peer_id] = username
-                return
-
-            elif pattern == JOIN_PART_RE:
-                action = result['action']
-                peer_id = result['peer_id']
-                try:
-                    username = self.peer_names[peer_id]
-                except KeyError:
-                    continue
-
-                result['username'] = username
-
-                if action == 'Join':
-                    result['message'] = 'joined the game'
-                else:
-                    result['message'] = 'left the game'
-
-                return result
-
-            elif pattern == CHAT_RE:
-                username = result['username']
-                if username == '<server>':
-                    continue
-                result['action'] = 'chat'
-                return result
-
-            elif pattern == ACTION_RE:
-                action = result['action']
-                message = result['message']
-
-                if result['username'] == '<server>':
-                    continue
-
-                if action in ACTIONS_RE:
-                    m = ACTIONS_RE[action].match(message)
-                    if m:
-                        result.update(m.groupdict())
-                        self.logger.debug(
-                            'additional regex match: %r' % m.groupdict())
-
-                return result
+        if LOG_RE.match(line):
+            if 'MapTick' in line:
+                return self.parse_join_part(line)
+            if 'Received peer info' in line:
+                return self.parse_peer_info(line)
+            return
+
+        m = CONSOLE_RE.match(line)
+        if m:
+            tag = m.group('tag')
+            if tag == 'CHAT':
+                return self.parse_chat(line, m)
+            if tag in ACTION_TAGS:
+                return self.parse_action(line, m)
+            return
+
+        return self.parse_chat(line)
+
+    def parse_chat(self, line, console_match=None):
+        if console_match:
+            m = CHAT_MESSAGE_RE.match(line, console_match.end())
+        else:
+            m = CHAT_MESSAGE_RE.match(line)
+        if not m:
+            return
+        self.hits['chat'] += 1
+
+        result = dict(date=None, time=None)
+        if console_match:
+            result.update(date=console_match.group('date'),
+                          time=console_match.group('time'))
+        result.update(m.groupdict())
+
+        self.logger.debug('regex match: %r', result)
+
+        if result['username'] == '<server>':
+            return
+        result['action'] = 'chat'
+        return result
+
+    def parse_action(self, line, console_match):
+        m = ACTION_MESSAGE_RE.match(line, console_match.end())
+        if not m:
+            return
+        self.hits['action'] += 1
+
+        result = dict(date=console_match.group('date'),
+                      time=console_match.group('time'),
+                      action=console_match.group('tag').lower())
+        result.update(m.groupdict())
+
+        self.logger.debug('regex match: %r', result)
+
+        if result['username'] == '<server>':
+            return
+
+        action = result['action']
+        if action in ACTIONS_RE:
+            m = ACTIONS_RE[action].match(result['message'])
+            if m:
+                result.update(m.groupdict())
+                self.logger.debug(
+                    'additional regex match: %r', m.groupdict())
+
+        return result
+
+    def parse_peer_info(self, line):
+        m = USERNAME_RE.match(line)
+        if not m:
+            return
+        self.hits['peer_info'] += 1
+
+        self.logger.debug('regex match: %r', m.groupdict())
+        self.peer_names[m.group('peer_id')] = m.group('username')
+
+    def parse_join_part(self, line):
+        m = JOIN_PART_RE.match(line)
+        if not m:
+            return
+        self.hits['join_part'] += 1
+
+        result = m.groupdict()
+        result['action'] = result['action'].lower()
+
+        self.logger.debug('regex match: %r', result)
+
+        try:
+            result['username'] = self.peer_names[result['peer_id']]
+        except KeyError:
+            return
+
+        if result['action'] == 'join':
+            result['message'] = 'joined the game'
+        else:
+            result['message'] = 'left the game'
+            self.peer_names.pop(result['peer_id'])
+
+        return result
@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import collections
+
+__all__ = ['Metrics', 'LabeledMetrics', 'Histogram']
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets"""
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the `q` quantile"""
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Counters and histograms, rendered in the Prometheus text format.
+
+    Hot paths only increment counters or observe values. Metrics that are
+    already tracked elsewhere (queue sizes, component statistics) are
+    read when rendering, by collectors: callables returning a list of
+    `(name, labels, value)` samples. Those are reported as gauges, unless
+    their name ends with `_total` (the counter naming convention).
+    """
+
+    def __init__(self, prefix='factoirc_'):
+        self.prefix = prefix
+        self.counters = collections.defaultdict(int)
+        self.histograms = {}
+        self.collectors = []
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        self.counters[self.key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        try:
+            histogram = self.histograms[key]
+        except KeyError:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def labeled(self, **labels):
+        return LabeledMetrics(self, **labels)
+
+    def counter(self, name, **labels):
+        return self.counters.get(self.key(name, labels), 0)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get(self.key(name, labels))
+
+    def gauges(self):
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                yield self.key(name, labels), value
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+            for k, v in labels)
+
+    def render(self):
+        """Return all the metrics in the Prometheus text format"""
+
+        lines = []
+        types = {}
+
+        def sample(name, labels, value, kind):
+            name = self.prefix + name
+            if name not in types:
+                types[name] = kind
+                lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s%s %s' % (name, self.format_labels(labels), value))
+
+        for (name, labels), value in sorted(self.counters.items()):
+            sample(name, labels, value, 'counter')
+
+        for (name, labels), value in sorted(self.gauges()):
+            sample(name, labels, value,
+                   'counter' if name.endswith('_total') else 'gauge')
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            name = self.prefix + name
+            if name not in types:
+                types[name] = 'histogram'
+                lines.append('# TYPE %s histogram' % name)
+
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append('%s_bucket%s %s' % (
+                    name, self.format_labels(labels, [('le', bound)]), total))
+            lines.append('%s_bucket%s %s' % (
+                name, self.format_labels(labels, [('le', '+Inf')]),
+                histogram.count))
+            lines.append('%s_sum%s %s' % (
+                name, self.format_labels(labels), histogram.sum))
+            lines.append('%s_count%s %s' % (
+                name, self.format_labels(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Skip the headers
+
+            if request.split()[1:2] == [b'/metrics']:
+                status = '200 OK'
+                body = self.render().encode('utf-8')
+            else:
+                status = '404 Not Found'
+                body = b'Not found\n'
+
+            writer.write((
+                'HTTP/1.0 %s\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                'Content-Length: %d\r\n'
+                '\r\n' % (status, len(body))).encode('ascii') + body)
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Serve the metrics over HTTP at /metrics"""
+
+        return await asyncio.start_server(
+            self.handle_http, host, port)
+
+
+class LabeledMetrics:
+    """View of a Metrics registry adding `labels` to all its samples"""
+
+    def __init__(self, metrics, **labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def inc(self, name, value=1, **labels):
+        self.metrics.inc(name, value, **dict(self.labels, **labels))
+
+    def observe(self, name, value, **labels):
+        self.metrics.observe(name, value, **dict(self.labels, **labels))
+
+    def add_collector(self, collector):
+        def collect():
+            return [(name, dict(self.labels, **labels), value)
+                    for name, labels, value in collector()]
+        self.metrics.add_collector(collect)
+
+    def counter(self, name, **labels):
+        return self.metrics.counter(name, **dict(self.labels, **labels))
+
+    def histogram(self, name, **labels):
+        return self.metrics.histogram(name, **dict(self.labels, **labels))
@@ -7,8 +7,11 @@
 
 """Source server RCON communications module"""
 
+import codecs
 import struct
+import logging
 import itertools
+import collections
 import asyncio
 
 
@@ -19,11 +22,16 @@ SERVERDATA_EXECCOMMAND = 2
 SERVERDATA_RESPONSE_VALUE = 0
 
 
+HEADER = struct.Struct('<3i')  # size, ID, type
+
+
 class RconPacket(object):
 
     """RCON packet"""
 
-    _struct = struct.Struct('<3i')
+    __slots__ = ('pkt_id', 'pkt_type', 'body')
+
+    _struct = HEADER
 
     def __init__(self, pkt_id=0, pkt_type=-1, body=b''):
         self.pkt_id = pkt_id
@@ -44,8 +52,306 @@ class RconPacket(object):
 
     def pack(self):
         """Return the packed version of the packet"""
-        header = self._struct.pack(self.size(), self.pkt_id, self.pkt_type)
-        return b'%s%s\x00\x00' % (header, self.body)
+        return RconCodec.encode([self])
+
+
+class RconCodec(object):
+
+    """Incremental RCON framing, without any I/O
+
+    Received data is passed to `feed()` in chunks of any size (partial
+    packets, several packets at once...), which returns the packets it
+    completes. Incomplete data is kept in a buffer until the rest arrives.
+    """
+
+    def __init__(self, max_packet_size=None):
+        self.buffer = bytearray()
+        self.max_packet_size = max_packet_size
+
+    def feed(self, data):
+        """Return the list of the packets completed by `data`"""
+
+        # Complete packets are parsed directly from `data`, only the
+        # leftovers are copied to the buffer
+        if self.buffer:
+            self.buffer += data
+            data = self.buffer
+
+        packets, pos = self._parse(data)
+
+        if data is self.buffer:
+            del self.buffer[:pos]
+        elif pos < len(data):
+            self.buffer += memoryview(data)[pos:]
+
+        return packets
+
+    def _parse(self, data):
+        packets = []
+        pos = 0
+        end = len(data)
+        unpack_from = HEADER.unpack_from
+        max_size = self.max_packet_size
+
+        with memoryview(data) as view:
+            while end - pos >= HEADER.size:
+                size, pkt_id, pkt_type = unpack_from(view, pos)
+                if size < 10 or (max_size and size > max_size):
+                    raise RconError('Invalid packet size: %d' % size)
+
+                pkt_end = pos + size + 4
+                if pkt_end > end:
+                    break
+
+                # The body is followed by 2 null bytes
+                packets.append(RconPacket(
+                    pkt_id, pkt_type,
+                    view[pos + HEADER.size:pkt_end - 2].tobytes()))
+                pos = pkt_end
+
+        return packets, pos
+
+    @staticmethod
+    def encode(packets):
+        """Return the wire format of several packets"""
+
+        data = bytearray(sum(len(pkt.body) + 14 for pkt in packets))
+        pos = 0
+        for pkt in packets:
+            size = len(pkt.body) + 10
+            HEADER.pack_into(data, pos, size, pkt.pkt_id, pkt.pkt_type)
+            pos += HEADER.size
+            data[pos:pos + len(pkt.body)] = pkt.body
+            pos += len(pkt.body) + 2  # null terminators
+        return bytes(data)
+
+
+class RconProtocol(asyncio.Protocol):
+
+    """asyncio protocol splitting the received data into RCON packets
+
+    Packets are passed to `on_packet` if it's set, and queued for `recv()`
+    otherwise (the transport stops reading while too many are queued).
+    `on_lost` is called with the error when the connection is lost.
+    """
+
+    max_queued = 64
+
+    def __init__(self, loop, max_packet_size=None):
+        self.loop = loop
+        self.codec = RconCodec(max_packet_size)
+        self.transport = None
+        self.on_packet = None
+        self.on_lost = None
+        self.packets = collections.deque()
+        self.waiter = None
+        self.error = None
+        self.paused = False
+        self.drain_waiter = None
+        self.write_paused = False
+
+    @property
+    def closed(self):
+        return self.error is not None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        try:
+            packets = self.codec.feed(data)
+        except RconError as ex:
+            self.transport.abort()
+            self.connection_lost(ex)
+            return
+
+        if self.on_packet:
+            for pkt in packets:
+                self.on_packet(pkt)
+            return
+
+        self.packets.extend(packets)
+        if len(self.packets) >= self.max_queued and not self.paused:
+            self.paused = True
+            self.transport.pause_reading()
+        self._wakeup(self.waiter)
+
+    def connection_lost(self, exc):
+        if self.closed:
+            return
+
+        self.error = exc or ConnectionResetError('Connection closed')
+        self._wakeup(self.waiter, self.error)
+        self._wakeup(self.drain_waiter, self.error)
+        if self.on_lost:
+            self.on_lost(self.error)
+
+    @staticmethod
+    def _wakeup(waiter, exc=None):
+        if waiter and not waiter.done():
+            if exc:
+                waiter.set_exception(exc)
+            else:
+                waiter.set_result(None)
+
+    async def recv(self):
+        """Return the next packet"""
+
+        while not self.packets:
+            if self.error:
+                raise self.error
+            self.waiter = self.loop.create_future()
+            await self.waiter
+
+        if self.paused and len(self.packets) < self.max_queued // 2:
+            self.paused = False
+            self.transport.resume_reading()
+        return self.packets.popleft()
+
+    def pause_writing(self):
+        self.write_paused = True
+
+    def resume_writing(self):
+        self.write_paused = False
+        self._wakeup(self.drain_waiter)
+
+    async def drain(self):
+        """Wait until the write buffer is flushed enough"""
+
+        if self.error:
+            raise self.error
+        if self.write_paused:
+            self.drain_waiter = self.loop.create_future()
+            await self.drain_waiter
+
+
+class RconResponse(object):
+
+    """Response to a command, possibly split into several packets
+
+    The server may split large responses into several packets sharing the
+    request ID. When `end_id` is set, packets are accumulated until the
+    response to the end marker request with that ID comes in.
+
+    The response is buffered (up to `max_size` bytes) and decoded at the
+    end, unless it is streamed, in which case decoded chunks are queued
+    as they arrive for an RconStream to consume. Then `max_size` bounds
+    the bytes received but not consumed yet.
+    """
+
+    def __init__(self, loop, pkt_id, end_id=None, encoding='utf-8',
+                 max_size=None, stream=False):
+        self.pkt_id = pkt_id
+        self.end_id = end_id
+        self.max_size = max_size
+        self.stream = stream
+        self.size = 0  # bytes buffered
+        self.chunks = collections.deque()  # (text, size) pairs if streamed
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.finished = loop.create_future()
+        self.loop = loop
+        self.readable = None  # future set when a chunk is queued
+        self.ended = False  # whether the last packet was received
+
+    def feed(self, pkt):
+        if pkt.pkt_id == self.pkt_id:
+            self.size += len(pkt.body)
+            if self.max_size is not None and self.size > self.max_size:
+                self.fail(RconError(
+                    'Response exceeds %d bytes' % self.max_size))
+
+        if pkt.pkt_id == self.pkt_id and not self.finished.done():
+            self._push(pkt.body)
+
+        if pkt.pkt_id == self.end_id:
+            self.ended = True
+            self._finish()
+        elif self.end_id is None:
+            # Without an end marker, more packets of a fragmented response
+            # may still follow
+            self._finish()
+
+    def fail(self, ex):
+        if not self.finished.done():
+            self.finished.set_exception(ex)
+            self._wakeup()
+
+    def _push(self, body):
+        if self.stream:
+            text = self.decoder.decode(body)
+            if text:
+                self.chunks.append((text, len(body)))
+                self._wakeup()
+            else:
+                self.size -= len(body)
+        else:
+            self.chunks.append(body)
+
+    def pop_chunk(self):
+        """Return the next streamed chunk, which stops counting"""
+
+        text, size = self.chunks.popleft()
+        self.size -= size
+        return text
+
+    def _finish(self):
+        if self.finished.done():
+            return
+        if self.stream:
+            text = self.decoder.decode(b'', True)
+            if text:
+                self.chunks.append((text, 0))
+            self.finished.set_result(None)
+        else:
+            self.finished.set_result(
+                self.decoder.decode(b''.join(self.chunks), True))
+            self.chunks.clear()
+        self._wakeup()
+
+    def _wakeup(self):
+        if self.readable and not self.readable.done():
+            self.readable.set_result(None)
+
+    def wait_readable(self):
+        """Return a future set when chunks are queued or at the end"""
+
+        self.readable = self.loop.create_future()
+        if self.chunks or self.finished.done():
+            self.readable.set_result(None)
+        return self.readable
+
+
+class RconStream(object):
+
+    """Async iterator over the body chunks of a command response"""
+
+    def __init__(self, conn, command):
+        self.conn = conn
+        self.command = command
+        self.response = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.response is None:
+            self.response = await self.conn._send_command(
+                self.command, multi_packet=True, stream=True)
+
+        response = self.response
+        try:
+            while not response.chunks:
+                if response.finished.done():
+                    # Raises the error if the response failed
+                    response.finished.result()
+                    raise StopAsyncIteration
+                await self.conn._wait_response(
+                    response, response.wait_readable())
+        except BaseException:
+            self.conn._forget(response)
+            raise
+
+        return response.pop_chunk()
 
 
 class RconConnection(object):
@@ -53,15 +359,34 @@ class RconConnection(object):
     """RCON client to server connection"""
 
     def __init__(self, server, port=27015, password='', loop=None,
-                 encoding='utf-8'):
+                 encoding='utf-8', pipelined=False, max_response_size=None):
         self.server = server
         self.port = port
         self.encoding = encoding
         self.password = password
-        self.loop = loop
+        self.loop = loop or asyncio.get_event_loop()
+        self.pipelined = pipelined
+        self.max_response_size = max_response_size
         self.authenticated = False
         self.pkt_id = itertools.count(1)
-        self.wr = None
+        self.transport = None
+        self.protocol = None
+        self.connect_time = None
+        self.auth_time = None
+        self.last_received = None
+
+        # Pending RconResponses by packet ID. In pipelined mode, incoming
+        # packets are matched to the requests waiting for them as soon as
+        # they're received
+        self.pending = {}
+
+    @property
+    def connected(self):
+        """Whether the connection is authenticated and still open"""
+
+        return (self.authenticated and
+                not self.protocol.closed and
+                not self.transport.is_closing())
 
     async def authenticate(self, password=None):
         """Authenticate with the server using the given password"""
@@ -70,14 +395,16 @@ class RconConnection(object):
             password = self.password
         password = password.encode(self.encoding)
 
-        self.rd, self.wr = await asyncio.open_connection(
-            self.server, self.port, loop=self.loop
-        )
+        start = self.loop.time()
+        self.transport, self.protocol = await self.loop.create_connection(
+            lambda: RconProtocol(self.loop), self.server, self.port)
+        self.connect_time = self.loop.time() - start
 
         auth_pkt = RconPacket(next(self.pkt_id), SERVERDATA_AUTH, password)
         await self._send_pkt(auth_pkt)
 
         auth_resp = await self.read_response()
+        self.auth_time = self.loop.time() - start - self.connect_time
 
         if auth_resp.pkt_type != SERVERDATA_AUTH_RESPONSE:
             raise RconError('Received invalid auth response packet')
@@ -86,44 +413,162 @@ class RconConnection(object):
             raise RconAuthError('Bad password')
 
         self.authenticated = True
+        self.last_received = self.loop.time()
 
-    async def exec_command(self, command, read_response=True):
+        if self.pipelined:
+            self.protocol.on_packet = self._dispatch
+            self.protocol.on_lost = self._connection_lost
+            # Packets received along with the auth response
+            while self.protocol.packets:
+                self._dispatch(self.protocol.packets.popleft())
+
+    async def exec_command(self, command, read_response=True,
+                           multi_packet=False):
         """
         Execute the given RCON command
         Return the response body
+
+        In pipelined mode, this can be called concurrently: many commands
+        can be in flight at the same time on the connection.
+
+        If `multi_packet` is set, responses split into several packets are
+        reassembled (see `RconResponse`).
         """
 
+        if not read_response:
+            if not self.authenticated:
+                await self.authenticate()
+            cmd_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND,
+                                 command.encode(self.encoding))
+            await self._send_pkt(cmd_pkt)
+            return cmd_pkt
+
+        response = await self._send_command(command, multi_packet)
+        try:
+            await self._wait_response(response, response.finished)
+        finally:
+            self._forget(response)
+
+        return response.finished.result()
+
+    def stream_command(self, command):
+        """
+        Execute the given RCON command
+        Return an async iterator over the response body chunks
+
+        Chunks are yielded as their packets arrive, without buffering the
+        whole response. Unless the connection is pipelined, the iterator
+        must be consumed entirely before the connection is used again.
+        """
+
+        return RconStream(self, command)
+
+    async def _send_command(self, command, multi_packet, stream=False):
+        """Send a command and return its pending RconResponse"""
+
         if not self.authenticated:
             await self.authenticate()
 
         cmd_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND,
                              command.encode(self.encoding))
+        packets = [cmd_pkt]
 
-        await self._send_pkt(cmd_pkt)
-        if read_response:
-            resp = await self.read_response(cmd_pkt)
-            return resp.body.decode(self.encoding)
+        if multi_packet or not self.pipelined:
+            # Responses are sent in order, so the response to an empty
+            # command sent right after this one marks the end of ours.
+            # Without pipelining, it's always needed to read the whole
+            # response before the connection can be reused.
+            end_pkt = RconPacket(next(self.pkt_id), SERVERDATA_EXECCOMMAND)
+            packets.append(end_pkt)
+            end_id = end_pkt.pkt_id
         else:
-            return cmd_pkt
+            end_id = None
+
+        response = RconResponse(
+            self.loop, cmd_pkt.pkt_id, end_id, encoding=self.encoding,
+            max_size=self.max_response_size, stream=stream)
+
+        # Register the request before sending so that the response
+        # can't arrive before anyone is waiting for it
+        self.pending[cmd_pkt.pkt_id] = response
+        if end_id is not None:
+            self.pending[end_id] = response
+
+        try:
+            await self._send_pkts(packets)
+        except BaseException:
+            self._forget(response)
+            raise
+
+        return response
+
+    async def _wait_response(self, response, waiter):
+        """Wait for `waiter`, reading packets inline if not pipelined"""
+
+        if self.pipelined:
+            await waiter
+            return
+
+        try:
+            while not waiter.done():
+                pkt = await self.read_response()
+                if pkt.pkt_id not in (response.pkt_id, response.end_id):
+                    raise RconError('Response ID does not match request ID')
+                response.feed(pkt)
+        except BaseException:
+            self._forget(response)
+            self.close()
+            raise
+
+        if response.finished.done() and not response.ended:
+            # The remaining packets of the response can't be told apart
+            # from those of the next command anymore
+            self.close()
+
+    def _forget(self, response):
+        self.pending.pop(response.pkt_id, None)
+        self.pending.pop(response.end_id, None)
+
+    def _dispatch(self, pkt):
+        """Pass an incoming packet to the pending request it answers"""
+
+        self.last_received = self.loop.time()
+        if (pkt.pkt_type != SERVERDATA_RESPONSE_VALUE and
+                pkt.pkt_type != SERVERDATA_AUTH_RESPONSE):
+            self._connection_lost(
+                RconError('Recieved unexpected RCON packet type'))
+            return
+
+        response = self.pending.get(pkt.pkt_id)
+
+        # Responses to cancelled requests (or to requests that didn't want
+        # one) are simply dropped
+        if response and not response.finished.done():
+            response.feed(pkt)
+
+    def _connection_lost(self, ex):
+        self._fail_pending(RconError('Connection lost: %s' % ex))
+        self.close()
+
+    def _fail_pending(self, ex):
+        for response in self.pending.values():
+            response.fail(ex)
+
+    async def _send_pkts(self, packets):
+        """Send several RCON packets at once over the connection"""
+
+        self.transport.write(RconCodec.encode(packets))
+        await self.protocol.drain()
 
     async def _send_pkt(self, pkt):
         """Send one RCON packet over the connection"""
 
-        data = pkt.pack()
-        self.wr.write(data)
-        await self.wr.drain()
+        await self._send_pkts([pkt])
 
     async def _recv_pkt(self):
         """Read one RCON packet"""
 
-        header = await self.rd.readexactly(struct.calcsize('<3i'))
-        (pkt_size, pkt_id, pkt_type) = struct.unpack('<3i', header)
-        body = await self.rd.readexactly(pkt_size - 8)
-
-        # Strip the 2 trailing nulls from the body
-        body = body.rstrip(b'\x00')
-
-        return RconPacket(pkt_id, pkt_type, body)
+        return await self.protocol.recv()
 
     async def read_response(self, request=None):
         """Return the next response packet"""
@@ -143,8 +588,350 @@ class RconConnection(object):
         return response
 
     def close(self):
-        if self.wr:
-            self.wr.close()
+        self.authenticated = False
+        self._fail_pending(RconError('Connection closed'))
+        if self.transport:
+            self.transport.close()
+
+
+class RconPool(object):
+
+    """Pool of persistent, authenticated RCON connections
+
+    Connections are opened lazily when a command needs one and are kept
+    open afterwards. Failed connection attempts are retried with an
+    exponential backoff, and connections that stayed idle for more than
+    `idle_check` seconds are probed before being reused.
+
+    In pipelined mode, connections are shared between concurrent commands
+    instead of being handed out exclusively: a command goes to the least
+    busy connection, and a new one is only opened when all of them have
+    requests in flight. Shared connections are probed too once they've
+    been idle for `idle_check` seconds, or when a command times out
+    without anything being received on them meanwhile. They're dropped
+    when the probe or a command fails.
+    """
+
+    def __init__(self, server, port=27015, password='', size=1, loop=None,
+                 encoding='utf-8', idle_check=30, ping_timeout=5,
+                 backoff_min=0.5, backoff_max=30, pipelined=False,
+                 max_response_size=None, metrics=None):
+        self.server = server
+        self.port = port
+        self.password = password
+        self.size = size
+        self.loop = loop or asyncio.get_event_loop()
+        self.encoding = encoding
+        self.idle_check = idle_check
+        self.ping_timeout = ping_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.pipelined = pipelined
+        self.max_response_size = max_response_size
+        self.metrics = metrics
+
+        self.idle = collections.deque()  # (connection, last used) pairs
+        self.semaphore = asyncio.Semaphore(size)
+        self.busy = 0  # connections handed out
+
+        self.shared = []  # pipelined connections
+        self.last_used = {}  # pipelined connection -> last command time
+        self.probing = set()  # pipelined connections suspected to be dead
+        self.connect_lock = asyncio.Lock()
+        self.backoff = 0
+        self.retry_at = 0
+        self.connect_errors = 0  # failed (or cancelled) connection attempts
+
+    async def _connect(self):
+        """Open a new authenticated connection, honoring the backoff"""
+
+        delay = self.retry_at - self.loop.time()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Timed out before the server could even be tried again
+                self.connect_errors += 1
+                raise
+
+        conn = RconConnection(self.server, self.port, self.password,
+                              loop=self.loop, encoding=self.encoding,
+                              pipelined=self.pipelined,
+                              max_response_size=self.max_response_size)
+        try:
+            await conn.authenticate()
+        except BaseException:
+            conn.close()
+            self.connect_errors += 1
+            self.backoff = min(max(self.backoff * 2, self.backoff_min),
+                               self.backoff_max)
+            self.retry_at = self.loop.time() + self.backoff
+            if self.metrics:
+                self.metrics.inc('rcon_connect_errors_total')
+            raise
+
+        self.backoff = 0
+        if self.metrics:
+            self.metrics.observe('rcon_connect_seconds', conn.connect_time)
+            self.metrics.observe('rcon_auth_seconds', conn.auth_time)
+        return conn
+
+    def pending(self):
+        """Return the number of requests waiting for a response"""
+
+        return self.busy + sum(len(conn.pending) for conn in self.shared)
+
+    async def _check(self, conn, last_used):
+        """Return whether an idle connection can be reused"""
+
+        if not conn.connected:
+            return False
+
+        if self.loop.time() - last_used < self.idle_check:
+            return True
+
+        try:
+            await asyncio.wait_for(conn.exec_command(''),
+                                   timeout=self.ping_timeout)
+        except (OSError, RconError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError):
+            return False
+
+        return True
+
+    async def acquire(self):
+        """Return a connection for exclusive use until it's released"""
+
+        await self.semaphore.acquire()
+        try:
+            conn = None
+            while self.idle and not conn:
+                conn, last_used = self.idle.pop()
+                if not await self._check(conn, last_used):
+                    conn.close()
+                    conn = None
+
+            if not conn:
+                conn = await self._connect()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        self.busy += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Give a connection back to the pool"""
+
+        if discard or not conn.connected:
+            conn.close()
+        else:
+            self.idle.append((conn, self.loop.time()))
+        self.busy -= 1
+        self.semaphore.release()
+
+    def _least_busy(self):
+        for conn in list(self.shared):
+            if not conn.connected:
+                self._discard(conn)
+        if self.shared:
+            return min(self.shared, key=lambda conn: len(conn.pending))
+
+    def _discard(self, conn):
+        """Close a pipelined connection and stop using it"""
+
+        conn.close()
+        if conn in self.shared:
+            self.shared.remove(conn)
+        self.last_used.pop(conn, None)
+
+    async def _check_shared(self, conn):
+        """Return whether a pipelined connection can be used"""
+
+        # The background reader notices closed connections right away, but
+        # not the ones silently dropped (eg, by a NAT timeout)
+        last_used = self.last_used.get(conn, 0)
+        if conn.pending or self.loop.time() - last_used < self.idle_check:
+            return True
+
+        self.last_used[conn] = self.loop.time()
+        if await self._check(conn, last_used):
+            return True
+
+        self._discard(conn)
+        return False
+
+    async def _probe_shared(self, conn):
+        try:
+            alive = await self._check(conn, 0)
+        finally:
+            self.probing.discard(conn)
+
+        if alive:
+            self.shared.append(conn)
+        else:
+            self._discard(conn)
+
+    async def _get_shared(self):
+        """Return a pipelined connection, opening one if needed"""
+
+        while True:
+            conn = self._least_busy()
+            if conn and (not conn.pending or len(self.shared) >= self.size):
+                if await self._check_shared(conn):
+                    return conn
+                continue
+
+            async with self.connect_lock:
+                conn = self._least_busy()
+                if conn and len(self.shared) >= self.size:
+                    continue
+                conn = await self._connect()
+                self.shared.append(conn)
+                self.last_used[conn] = self.loop.time()
+                return conn
+
+    async def _exec_shared(self, command, multi_packet):
+        conn = await self._get_shared()
+        start = self.loop.time()
+        try:
+            result = await conn.exec_command(
+                command, multi_packet=multi_packet)
+        except asyncio.CancelledError:
+            # Eg, timed out by the caller. If nothing at all was received
+            # meanwhile, the connection may be dead: probe it.
+            if conn.last_received < start and conn in self.shared:
+                # New commands go to other connections in the meantime
+                self.shared.remove(conn)
+                self.probing.add(conn)
+                self.loop.create_task(self._probe_shared(conn))
+            raise
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            self._discard(conn)
+            raise
+
+        self.last_used[conn] = self.loop.time()
+        return result
+
+    async def exec_command(self, command, multi_packet=False):
+        """
+        Execute the given RCON command on a pooled connection
+        Return the response body
+        """
+
+        if self.pipelined:
+            return await self._exec_shared(command, multi_packet)
+
+        conn = await self.acquire()
+        try:
+            result = await conn.exec_command(
+                command, multi_packet=multi_packet)
+        except BaseException:
+            # The state of the stream is unknown (eg, cancelled in the
+            # middle of a read), so don't reuse this connection.
+            self.release(conn, discard=True)
+            raise
+
+        self.release(conn)
+        return result
+
+    def close(self):
+        while self.idle:
+            conn, last_used = self.idle.pop()
+            conn.close()
+        while self.shared:
+            self._discard(self.shared[-1])
+        while self.probing:
+            self._discard(self.probing.pop())
+
+
+class CircuitBreaker(object):
+
+    """Fail fast while the RCON server is known to be unreachable
+
+    Callers check `check()` before a request and report its outcome with
+    `success()` or `failure()`. After `threshold` consecutive failures,
+    the circuit opens: `check()` raises RconUnavailable right away instead
+    of letting requests wait for their timeout.
+
+    While the circuit is open, `probe()` is tried in the background, after
+    `probe_interval` seconds then with an exponential backoff (up to
+    `probe_max` seconds). The first successful probe closes the circuit
+    and calls `on_close()`.
+    """
+
+    on_close = None
+    task = None
+
+    def __init__(self, loop, probe, log=None, threshold=3, probe_interval=1,
+                 probe_max=30, probe_timeout=5):
+        self.loop = loop
+        self.probe = probe
+        self.log = log or logging.getLogger(__name__)
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.probe_max = probe_max
+        self.probe_timeout = probe_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self.stats = collections.Counter()
+
+    def __del__(self):
+        if self.task:
+            self.task.cancel()
+
+    @property
+    def closed(self):
+        return self.opened_at is None
+
+    def check(self):
+        if not self.closed:
+            self.stats['rejected'] += 1
+            raise RconUnavailable(
+                'RCON unavailable for %ds' % (
+                    self.loop.time() - self.opened_at))
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.closed and self.failures >= self.threshold:
+            self.open()
+
+    def open(self):
+        self.log.warning('RCON unavailable after %d failures, probing it '
+                         'in the background', self.failures)
+        self.opened_at = self.loop.time()
+        self.stats['opened'] += 1
+        self.task = self.loop.create_task(self.run())
+
+    def close(self):
+        self.log.info('RCON available again after %.1fs',
+                      self.loop.time() - self.opened_at)
+        self.failures = 0
+        self.opened_at = None
+        self.task = None
+        if self.on_close:
+            self.on_close()
+
+    async def run(self):
+        delay = self.probe_interval
+        while True:
+            await asyncio.sleep(delay)
+            self.stats['probes'] += 1
+            try:
+                await asyncio.wait_for(self.probe(),
+                                       timeout=self.probe_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.log.debug('RCON probe failed: %r', ex)
+                delay = min(delay * 2, self.probe_max)
+            else:
+                self.close()
+                return
 
 
 class RconError(Exception):
@@ -156,21 +943,161 @@ class RconAuthError(RconError):
     """Raised if an RCON Authentication error occurs"""
 
 
-def main():
-    import sys
+class RconUnavailable(RconError):
+    """Raised while the circuit breaker is open"""
 
-    if len(sys.argv) < 5:
-        print('Usage: %s <host> <port> <password> <command>...' % sys.argv[0])
-        sys.exit(1)
 
-    host, port, password, *cmd = sys.argv[1:]
-    port = int(port)
-    cmd = ' '.join(cmd)
+def read_commands(stream):
+    """Yield the commands read from `stream`, one per line
+
+    Empty lines and lines starting with # are skipped.
+    """
+
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+async def run_batch(pool, commands, write, concurrency=1, timeout=None):
+    """Run `commands` over `pool`, with up to `concurrency` of them in
+    flight, and pass the results to `write(command, response, error,
+    seconds)` in order.
+
+    Return the number of commands that failed.
+    """
+
+    loop = pool.loop
+    pending = collections.deque()
+    errors = 0
+
+    async def run(command):
+        start = loop.time()
+        try:
+            response = await asyncio.wait_for(
+                pool.exec_command(command, multi_packet=True),
+                timeout=timeout)
+        except RconAuthError:
+            raise
+        except asyncio.TimeoutError:
+            return command, None, 'Timeout', loop.time() - start
+        except (OSError, RconError) as ex:
+            return command, None, str(ex), loop.time() - start
+        return command, response, None, loop.time() - start
+
+    def done(result):
+        nonlocal errors
+        if result[2] is not None:
+            errors += 1
+        write(*result)
+
+    try:
+        for command in commands:
+            pending.append(loop.create_task(run(command)))
+            if len(pending) >= concurrency:
+                done(await pending.popleft())
+        while pending:
+            done(await pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return errors
+
+
+def main(args=None):
+    import sys
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m factoirc.rcon',
+        description='Run RCON commands. Without a command on the command '
+                    'line, commands are read from --file (one per line).')
+    parser.add_argument('host')
+    parser.add_argument('port', type=int)
+    parser.add_argument('password')
+    parser.add_argument('command', nargs='*',
+                        help='command to run')
+    parser.add_argument('-f', '--file', default='-',
+                        help="file to read the commands from, '-' for the "
+                             "standard input (default)")
+    parser.add_argument('-c', '--concurrency', type=int, default=1,
+                        help='number of commands in flight at once '
+                             '(default: %(default)s)')
+    parser.add_argument('-t', '--timeout', type=float,
+                        help='timeout of each command, in seconds')
+    parser.add_argument('--json', action='store_true',
+                        help='write the results as JSON lines, with '
+                             'timings')
+    args = parser.parse_args(args)
 
     loop = asyncio.get_event_loop()
-    conn = RconConnection(host, port, password)
-    resp = loop.run_until_complete(conn.exec_command(cmd))
-    print(resp, end='')
+
+    if args.command and not args.json:
+        # Single command: print the response as it arrives
+        cmd = ' '.join(args.command)
+
+        async def run():
+            async for chunk in conn.stream_command(cmd):
+                print(chunk, end='', flush=True)
+
+        conn = RconConnection(args.host, args.port, args.password, loop=loop)
+        try:
+            loop.run_until_complete(asyncio.wait_for(
+                run(), timeout=args.timeout))
+        except asyncio.TimeoutError:
+            sys.exit('Error: Timeout')
+        except (OSError, RconError) as ex:
+            sys.exit('Error: %s' % ex)
+        finally:
+            conn.close()
+        return
+
+    if args.command:
+        commands = [' '.join(args.command)]
+        stream = None
+    elif args.file == '-':
+        stream = sys.stdin
+        commands = read_commands(stream)
+    else:
+        stream = open(args.file, encoding='utf-8')
+        commands = read_commands(stream)
+
+    count = collections.Counter()
+
+    def write(command, response, error, seconds):
+        count['commands'] += 1
+        if args.json:
+            print(json.dumps(dict(command=command, response=response,
+                                  error=error, seconds=round(seconds, 6))),
+                  flush=True)
+        elif error is not None:
+            print('Error: %s: %s' % (command, error), file=sys.stderr)
+        elif response:
+            print(response, end='' if response.endswith('\n') else '\n',
+                  flush=True)
+
+    # Commands share a single pipelined connection, which is reopened if
+    # it's lost
+    pool = RconPool(args.host, args.port, args.password,
+                    pipelined=True, loop=loop)
+    start = loop.time()
+    try:
+        errors = loop.run_until_complete(run_batch(
+            pool, commands, write,
+            concurrency=max(args.concurrency, 1), timeout=args.timeout))
+    except (OSError, RconError) as ex:
+        sys.exit('Error: %s' % ex)
+    finally:
+        pool.close()
+        if stream and stream is not sys.stdin:
+            stream.close()
+
+    print('%d commands in %.2fs, %d failed' % (
+        count['commands'], loop.time() - start, errors), file=sys.stderr)
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,96 +1,1022 @@
 import os
+import re
+import abc
 import sys
+import gzip
+import json
+import errno
 import asyncio
+import logging
+import functools
+import collections
+import ctypes
+import ctypes.util
 
 try:
     from systemd import journal
 except ImportError:
     journal = None
 
+from .log_parser import line_timestamp
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1
+except (OSError, AttributeError):
+    libc = None
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+
+# Syslog header of a message, RFC 5424 or the older BSD format (RFC 3164)
+SYSLOG_SD = r'(?:-|(?:\[(?:[^"\]]|"(?:[^"\\]|\\.)*")*\])+)'
+SYSLOG_RE = re.compile(
+    r'<\d{1,3}>(?:'
+    r'1 \S+ (?P<host>\S+) \S+ \S+ \S+ ' + SYSLOG_SD + r'(?: |$)'
+    r'|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d (?P<bsd_host>\S+) [^:\s]+: ?'
+    r')?'
+)
+
+# Octet-counting framing (RFC 6587) of syslog messages over TCP
+OCTET_COUNT_RE = re.compile(rb'(\d{1,9}) (?=<)')
+
+
+class Inotify:
+    """Minimal inotify(7) binding, only used to know when to read again"""
+
+    def __init__(self):
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+        return wd
+
+    def drain(self):
+        """Discard the pending events"""
+
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_log(path):
+    """Open a log file for reading, decompressing it if it's gzipped
+
+    `path` can be '-' for the standard input.
+    """
+
+    if path == '-':
+        stream = sys.stdin.buffer
+    else:
+        stream = open(path, 'rb')
+
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def iter_lines(stream):
+    """Yield the lines of a binary stream, decoded"""
+
+    for line in stream:
+        yield line.decode('utf-8', 'replace').rstrip('\r\n')
+
+
+def load_state(path):
+    """Return the state saved in `path`, or None"""
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path, state):
+    """Atomically replace the state saved in `path`"""
+
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, path)
+
+
+class StateFile:
+    """Remember how far a log has been forwarded in `path`.
+
+    The state is updated as the lines are handled (see LineQueue), and
+    written at most every `interval` seconds.
+    """
+
+    def __init__(self, loop, path, interval=1):
+        self.loop = loop
+        self.path = path
+        self.interval = interval
+        self.state = self.saved = None
+        self.saved_time = 0
+        self.save_handle = None
+        self.log = logging.getLogger(__name__)
+
+    def load(self):
+        self.state = self.saved = load_state(self.path)
+        return self.state
+
+    def update(self, state):
+        self.state = state
+        if state == self.saved:
+            return
+
+        delay = self.saved_time + self.interval - self.loop.time()
+        if delay > 0:
+            if not self.save_handle:
+                self.save_handle = self.loop.call_later(delay, self.save)
+            return
+
+        self.save()
+
+    def save(self):
+        if self.save_handle:
+            self.save_handle.cancel()
+            self.save_handle = None
+
+        if self.state == self.saved:
+            return
+
+        try:
+            save_state(self.path, self.state)
+        except OSError as ex:
+            self.log.error('Unable to save the log state: %s', ex)
+        self.saved_time = self.loop.time()
+        self.saved = self.state
+
+    def close(self):
+        """Write the pending state right away"""
+
+        self.save()
+
 
 class StreamLogReader:
+    """Read log lines from a stream and put them into `queue`.
+
+    Data is read directly from the file descriptor in large chunks and
+    split into lines in the event loop.
+
+    If the stream is a file, it's followed from its end like `tail -f`:
+    when inotify is available, the reader sleeps until the file is
+    modified, otherwise the file is polled, more slowly as it stays idle
+    (from `min_poll` to `max_poll` seconds).
+
+    Other streams (pipes) are read when the event loop reports them as
+    readable, and reading stops at EOF.
+
+    Reading pauses while the queue (see LineQueue) has no room.
+    """
+
     task = None
 
-    def __init__(self, stream, loop, callback, **kwargs):
+    chunk_size = 64 * 1024
+    min_poll = 0.01
+    max_poll = 1
+    inotify_timeout = 5
+
+    def __init__(self, stream, loop, queue, **kwargs):
         self.stream = stream
         self.loop = loop
-        self.callback = callback
+        self.queue = queue
+        self.fd = stream.fileno()
+        self.buffer = b''
+        self.inotify = None
         self.task = loop.create_task(self.log_read())
 
-        # If the stream is a file, seek to its end
         if self.stream.seekable():
-            self.stream.seek(0, os.SEEK_END)
+            self.seek_start()
+            self.watch()
+        else:
+            os.set_blocking(self.fd, False)
 
     def __del__(self):
         if self.task:
             self.task.cancel()
+        if self.inotify:
+            self.inotify.close()
+
+    def seek_start(self):
+        """Set the position where the file starts being read"""
+
+        self.stream.seek(0, os.SEEK_END)
+
+    def watch(self):
+        """Set up inotify to know when to read the file again"""
+
+        try:
+            self.inotify = Inotify()
+            self.inotify.add_watch(
+                '/proc/self/fd/%d' % self.fd,
+                IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF)
+        except OSError:
+            if self.inotify:
+                self.inotify.close()
+            self.inotify = None
+
+    def on_idle(self):
+        """Called after waiting for more data at the end of the file"""
+
+    def on_eof(self):
+        """Called at the end of the file, return True to read on at once"""
+
+        return False
+
+    async def readable(self, fd):
+        """Wait until `fd` is readable"""
+
+        future = self.loop.create_future()
+
+        def on_readable():
+            # The future may have been cancelled (eg, by wait_for) before
+            # the reader is removed
+            if not future.done():
+                future.set_result(None)
+
+        self.loop.add_reader(fd, on_readable)
+        try:
+            await future
+        finally:
+            self.loop.remove_reader(fd)
+
+    async def wait_data(self, delay):
+        """Wait until the file is likely to have more data"""
+
+        if not self.inotify:
+            await asyncio.sleep(delay)
+            return
+
+        try:
+            await asyncio.wait_for(self.readable(self.inotify.fd),
+                                   self.inotify_timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.inotify.drain()
+
+    async def read_pipe(self):
+        try:
+            await self.readable(self.fd)
+        except (OSError, ValueError, NotImplementedError):
+            # This event loop can't watch this kind of file
+            os.set_blocking(self.fd, True)
+            return await self.loop.run_in_executor(
+                None, os.read, self.fd, self.chunk_size)
+
+        try:
+            return os.read(self.fd, self.chunk_size)
+        except BlockingIOError:
+            return None
+
+    def feed(self, data):
+        """Split data into lines and pass the complete ones"""
+
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            self.on_line(line)
+
+    def on_line(self, line, on_done=None):
+        line = line.decode('utf-8', 'replace').rstrip('\r')
+        self.queue.put_nowait(self, line, on_done)
 
     async def log_read(self):
+        seekable = self.stream.seekable()
+        delay = self.min_poll
+
         while True:
-            line = await self.loop.run_in_executor(
-                None,
-                self.stream.readline
-            )
-            if not line:  # EOF reached
-                if not self.stream.seekable():
-                    break
-                await asyncio.sleep(0.2, loop=self.loop)
+            if seekable:
+                data = os.read(self.fd, self.chunk_size)
+            else:
+                data = await self.read_pipe()
+                if data is None:  # spurious wakeup
+                    continue
+
+            if data:
+                self.feed(data)
+                delay = self.min_poll
+                if self.queue.policy == 'block':
+                    await self.queue.wait_room()
+                else:
+                    # The queue drops lines instead of making us wait, let
+                    # the other tasks run while catching up with the file
+                    await asyncio.sleep(0)
                 continue
-            line = line.strip('\n')
-            self.loop.create_task(self.callback(line))
+
+            # EOF reached
+            if not seekable:
+                if self.buffer:
+                    self.on_line(self.buffer)
+                break
+
+            if self.on_eof():
+                continue
+
+            await self.wait_data(delay)
+            delay = min(delay * 2, self.max_poll)
+            self.on_idle()
 
 
 class StdinLogReader(StreamLogReader):
-    def __init__(self, loop, callback, **kwargs):
-        super().__init__(sys.stdin, loop, callback, **kwargs)
+    def __init__(self, loop, queue, **kwargs):
+        super().__init__(sys.stdin, loop, queue, **kwargs)
 
 
 class FileLogReader(StreamLogReader):
-    def __init__(self, loop, callback, file, **kwargs):
-        stream = open(file, encoding='utf-8')
-        super().__init__(stream, loop, callback, **kwargs)
+    """Follow a log file, even if it's truncated or rotated.
+
+    When the file is truncated, it's read again from its start. When it's
+    replaced by a new file (eg, moved away by logrotate), the rest of the
+    old file is read, then the new one is read from its start.
+
+    If `state_file` is set, the inode and position of the last line
+    handled are saved to it, so that reading resumes right after that line
+    when the reader is started again.
+    """
+
+    state_interval = 1
+
+    def __init__(self, loop, queue, file, state_file=None, **kwargs):
+        self.path = file
+        self.state = state_file and StateFile(
+            loop, state_file, self.state_interval)
+        self.last_mtime = None
+        self.replaced = False
+        self.reopen_failed = False
+        self.log = logging.getLogger(__name__)
+        self.file_id = None  # (st_dev, st_ino)
+        self.read_position = 0  # end of the last line queued
+        stream = open(file, 'rb')
+        super().__init__(stream, loop, queue, **kwargs)
+
+    def __del__(self):
+        super().__del__()
+        if self.state:
+            self.state.close()
+
+    def watch(self):
+        super().watch()
+
+        # Also watch the directory for a replacement of the file
+        if self.inotify:
+            try:
+                self.inotify.add_watch(
+                    os.path.dirname(os.path.abspath(self.path)),
+                    IN_CREATE | IN_MOVED_TO)
+            except OSError:
+                pass
+
+    def load_state(self):
+        state = self.state.load()
+        try:
+            return state['dev'], state['ino'], int(state['pos'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def seek_start(self):
+        st = os.fstat(self.fd)
+        self.file_id = st.st_dev, st.st_ino
+
+        state = self.state and self.load_state()
+        if not state:
+            super().seek_start()
+        elif state[:2] == self.file_id and state[2] <= st.st_size:
+            self.stream.seek(state[2])
+        else:
+            # The file was replaced or truncated in the meantime
+            self.stream.seek(0)
+
+        self.read_position = self.stream.tell()
+
+    def on_line(self, line, on_done=None):
+        self.read_position += len(line) + 1
+        if self.state:
+            on_done = functools.partial(
+                self.line_done, self.file_id, self.read_position)
+        super().on_line(line, on_done)
+
+    def line_done(self, file_id, position):
+        dev, ino = file_id
+        self.state.update(dict(dev=dev, ino=ino, pos=position))
+
+    def feed(self, data):
+        super().feed(data)
+        self.last_mtime = None
+
+    def on_idle(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # Moved away, keep reading the old file until a new one appears
+            return
+
+        pos = os.lseek(self.fd, 0, os.SEEK_CUR)
+        last_mtime, self.last_mtime = self.last_mtime, st.st_mtime_ns
+
+        if (st.st_dev, st.st_ino) != self.file_id:
+            # Read the rest of the old file first, see on_eof()
+            self.replaced = True
+        elif (st.st_size < pos or
+              # Truncated and rewritten up to the same size
+              st.st_size == pos and last_mtime not in (None, st.st_mtime_ns)):
+            self.buffer = b''
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            self.read_position = 0
+            self.last_mtime = None
+
+    def on_eof(self):
+        # If the new file can't be opened yet, try again after waiting
+        return self.replaced and self.reopen()
+
+    def reopen(self):
+        """Switch to the new file, once the old one has been read
+
+        Return whether it could be opened.
+        """
+
+        try:
+            stream = open(self.path, 'rb')
+        except OSError as ex:
+            if not self.reopen_failed:
+                self.log.error('Unable to open the new log file: %s', ex)
+                self.reopen_failed = True
+            return False
+
+        self.reopen_failed = False
+        if self.buffer:
+            # The last line of the old file has no line feed
+            self.read_position -= 1
+            self.on_line(self.buffer)
+            self.buffer = b''
+
+        self.stream.close()
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+        self.stream = stream
+        self.fd = self.stream.fileno()
+        st = os.fstat(self.fd)
+        self.file_id = st.st_dev, st.st_ino
+        self.read_position = 0
+        self.replaced = False
+        self.last_mtime = None
+        self.watch()
+        return True
 
 
 class SystemdJournalLogReader:
-    def __init__(self, loop, callback, unit, **kwargs):
+    """Read the log messages of a systemd unit from the journal.
+
+    Only the MESSAGE field of the entries is read, at most `batch_size`
+    entries at a time before letting the event loop run again.
+
+    If `state_file` is set, the cursor of the last entry handled is saved
+    to it, so that reading resumes right after that entry when the reader
+    is started again. Otherwise, only the new entries are read.
+    """
+
+    task = None
+    batch_size = 100
+    state_interval = 1
+
+    def __init__(self, loop, queue, unit, state_file=None, **kwargs):
         if journal is None:
             raise ImportError('Please install the systemd python module')
 
         self.loop = loop
-        self.callback = callback
+        self.queue = queue
+        self.state = state_file and StateFile(
+            loop, state_file, self.state_interval)
+
         self.reader = journal.Reader()
         self.reader.add_match(_SYSTEMD_UNIT=unit)
-        self.reader.seek_tail()
-
-        # seek_tail() still leaves a few messages at the end
-        # so we have to consume them first
-        list(self.reader)
+        self.seek_start()
 
         self.fd = self.reader.fileno()
         self.loop.add_reader(self.fd, self.on_fd_ready)
 
     def __del__(self):
+        if self.task:
+            self.task.cancel()
+        if self.state:
+            self.state.close()
         self.loop.remove_reader(self.fd)
 
+    def seek_start(self):
+        """Set the position where the journal starts being read"""
+
+        state = self.state and self.state.load()
+        cursor = state.get('cursor') if isinstance(state, dict) else None
+        if cursor:
+            try:
+                self.reader.seek_cursor(cursor)
+                # Move to the entry itself, it was already read. If it's
+                # gone (eg, vacuumed), this is the next one: step back so
+                # that it's read.
+                moved = self.reader._next()
+                if moved and not self.reader.test_cursor(cursor):
+                    self.reader._previous()
+                return
+            except (OSError, ValueError):
+                pass
+
+        # Only the last entry is looked at, the next ones are new
+        self.reader.seek_tail()
+        self.reader._previous()
+
+    def read_batch(self):
+        """Queue up to `batch_size` entries, return whether more may follow"""
+
+        for i in range(self.batch_size):
+            if not self.reader._next():
+                return False
+            try:
+                message = self.reader._get('MESSAGE')
+            except KeyError:
+                continue
+            if isinstance(message, bytes):
+                message = message.decode('utf-8', 'replace')
+
+            on_done = None
+            if self.state:
+                on_done = functools.partial(
+                    self.line_done, self.reader._get_cursor())
+            self.queue.put_nowait(self, message, on_done)
+
+        return True
+
+    def line_done(self, cursor):
+        self.state.update(dict(cursor=cursor))
+
     def on_fd_ready(self):
-        for entry in self.reader:
-            if not entry:  # empty dict = no more entries
-                break
-            self.loop.create_task(self.callback(entry['MESSAGE']))
         self.reader.process()
+        more = self.read_batch()
+
+        if self.queue.full() and self.queue.policy == 'block':
+            # Stop reading until there's room in the queue
+            self.loop.remove_reader(self.fd)
+            self.task = self.loop.create_task(self.resume())
+        elif more:
+            self.loop.call_soon(self.on_fd_ready)
+
+    async def resume(self):
+        await self.queue.wait_room()
+        self.task = None
+        self.loop.add_reader(self.fd, self.on_fd_ready)
+        self.on_fd_ready()
+
+
+class ReplayLogReader:
+    """Replay an existing log file (possibly gzip-compressed).
+
+    Lines are paced by their timestamps, `replay_speed` times faster than
+    they were written. With a speed of 0, they're read as fast as the
+    queue accepts them.
+
+    Console lines (dated) and other log lines (stamped with the server
+    uptime) are each paced against their own reference time.
+    """
+
+    task = None
+
+    # Let the event loop run at least every this many lines
+    batch_size = 100
+
+    def __init__(self, loop, queue, file, replay_speed=0, **kwargs):
+        self.loop = loop
+        self.queue = queue
+        self.path = file
+        self.speed = float(replay_speed)
+        self.task = loop.create_task(self.replay())
+
+    def __del__(self):
+        if self.task:
+            self.task.cancel()
+
+    async def wait(self, timestamp):
+        """Wait until it's time to replay a line written at `timestamp`
+        (a (clock, time) pair, see line_timestamp)"""
+
+        if timestamp is None:
+            return
+
+        clock, timestamp = timestamp
+        now = self.loop.time()
+        first, start = self.references.get(clock, (None, None))
+        if first is None or timestamp < first:
+            # First line of this clock, or the server was restarted
+            # (uptime timestamps)
+            self.references[clock] = timestamp, now
+            return
+
+        delay = start + (timestamp - first) / self.speed - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def replay(self):
+        self.references = {}  # clock -> (first timestamp, start time)
+
+        with open_log(self.path) as stream:
+            for i, line in enumerate(iter_lines(stream)):
+                if self.speed:
+                    await self.wait(line_timestamp(line))
+                elif not i % self.batch_size:
+                    await asyncio.sleep(0)
+
+                self.queue.put_nowait(self, line)
+                await self.queue.wait_room()
+
+
+def parse_syslog(message):
+    """Return the host and text of a syslog message
+
+    The host is None if the message has no syslog header (a plain log
+    line).
+    """
+
+    m = SYSLOG_RE.match(message)
+    if not m:
+        return None, message
+
+    host = m.group('host') or m.group('bsd_host')
+    if host == '-':
+        host = None
+    return host, message[m.end():].lstrip('\ufeff')
+
+
+class NetworkListener(metaclass=abc.ABCMeta):
+    """TCP or UDP socket receiving log lines from remote hosts.
+
+    Messages can be plain log lines or syslog messages (RFC 5424, or the
+    older BSD format), whose header is stripped. They're passed to the
+    NetworkLogReader of their sender: the one whose `log_source` lists
+    the syslog host name or the sender address, or else the one without
+    a `log_source`. Several readers (one for each Factorio server) can
+    share a listener this way.
+
+    Listeners are shared by the readers listening on the same address,
+    and closed along with the last of them. Messages longer than
+    `max_line_length` bytes are dropped.
+    """
+
+    listeners = {}  # (class, host, port) -> listener
+
+    task = None
+
+    def __init__(self, loop, host, port, max_line_length=65536):
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.max_line_length = max_line_length
+        self.log = logging.getLogger(__name__)
+        self.readers = []
+        self.stats = collections.Counter()
+        self.server = None
+        self.task = loop.create_task(self.listen())
+
+    @classmethod
+    def get(cls, loop, host, port, **kwargs):
+        key = cls, host, port
+        listener = cls.listeners.get(key)
+        if listener is None:
+            listener = cls.listeners[key] = cls(loop, host, port, **kwargs)
+        return listener
+
+    def add(self, reader):
+        if not reader.sources and any(not other.sources
+                                      for other in self.readers):
+            raise ValueError(
+                'Several servers receive all the logs sent to %s:%d, '
+                'please set their log_source' % (self.host, self.port))
+        self.readers.append(reader)
+
+    def remove(self, reader):
+        if reader in self.readers:
+            self.readers.remove(reader)
+        if not self.readers:
+            self.close()
+
+    def close(self):
+        self.listeners.pop((type(self), self.host, self.port), None)
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.server:
+            self.server.close()
+            self.server = None
+
+    def allowed(self, address):
+        if any(reader.allowed(address) for reader in self.readers):
+            return True
+        self.log.warning('Log sender not allowed: %s', address)
+        self.stats['rejected'] += 1
+        return False
+
+    def reader_for(self, address, host):
+        """Return the reader of the logs sent by `address` (and `host`)"""
+
+        default = None
+        for reader in self.readers:
+            if not reader.sources:
+                default = reader
+            elif host in reader.sources or address in reader.sources:
+                return reader
+        return default
+
+    def on_message(self, source, address, data, wait=True):
+        """Pass a message received from `address` to its reader
+
+        Return that reader, or None. Unless `wait` is set, the message is
+        dropped if the reader's queue is full.
+        """
+
+        if len(data) > self.max_line_length:
+            self.stats['oversized'] += 1
+            return
+
+        message = data.decode('utf-8', 'replace').rstrip('\r\n')
+        host, text = parse_syslog(message)
+
+        reader = self.reader_for(address, host)
+        if reader is None or not reader.allowed(address):
+            self.stats['unmatched'] += 1
+            return
+        if not wait and reader.queue.full():
+            # Datagrams can't wait, the senders would only lose newer ones
+            reader.stats['dropped'] += 1
+            return
+
+        if host:
+            # Eg, a relay forwarding the logs of several hosts
+            source = source, host
+        reader.on_message(source, host or address, text)
+        return reader
+
+    async def listen(self):
+        try:
+            await self.create_server()
+        except OSError as ex:
+            self.log.error('Unable to listen on %s:%d: %s',
+                           self.host, self.port, ex)
+            return
+        self.log.info('Listening for log lines on %s:%d',
+                      self.host, self.port)
+
+    @abc.abstractmethod
+    async def create_server(self):
+        """Start receiving the messages, see TcpListener and UdpListener"""
+
+
+class TcpLogProtocol(asyncio.Protocol):
+    """A connection to a TcpListener
+
+    Messages are either separated by line feeds or prefixed by their
+    length (octet-counting). At most `max_line_length` bytes are buffered.
+    """
+
+    transport = None
+    address = None
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.buffer = bytearray()
+        self.skipping = False  # in the middle of an oversized line
+
+    def connection_made(self, transport):
+        self.address = transport.get_extra_info('peername')[0]
+        if not self.listener.allowed(self.address):
+            transport.abort()
+            return
+
+        self.transport = transport
+        self.listener.connections.add(self)
+        self.listener.stats['connections'] += 1
+
+    def connection_lost(self, exc):
+        if self.transport is None:
+            return
+        self.listener.connections.discard(self)
+        if self.buffer and not self.skipping:
+            self.listener.on_message(self, self.address, bytes(self.buffer))
+        self.buffer.clear()
+
+    def data_received(self, data):
+        buffer = self.buffer
+        buffer += data
+        listener = self.listener
+        max_length = listener.max_line_length
+        readers = set()
+        pos = 0
+
+        while pos < len(buffer):
+            m = OCTET_COUNT_RE.match(buffer, pos)
+            if m and not self.skipping:
+                start = m.end()
+                end = start + int(m.group(1))
+                if end > len(buffer):
+                    if end - pos > max_length + 10:
+                        listener.stats['oversized'] += 1
+                        self.transport.abort()
+                        return
+                    break
+                readers.add(listener.on_message(
+                    self, self.address, bytes(buffer[start:end])))
+                pos = end
+                continue
+
+            end = buffer.find(b'\n', pos)
+            if end < 0:
+                if len(buffer) - pos > max_length:
+                    # Skip the line up to its end
+                    listener.stats['oversized'] += 1
+                    self.skipping = True
+                    pos = len(buffer)
+                break
+
+            if self.skipping:
+                self.skipping = False
+            else:
+                readers.add(listener.on_message(
+                    self, self.address, bytes(buffer[pos:end])))
+            pos = end + 1
+
+        del buffer[:pos]
+
+        full = [reader.queue for reader in readers
+                if reader and reader.queue.full()]
+        if full:
+            self.transport.pause_reading()
+            listener.loop.create_task(self.resume(full))
+
+    async def resume(self, queues):
+        for queue in queues:
+            await queue.wait_room()
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+
+
+class TcpListener(NetworkListener):
+    """Receive log lines over TCP connections.
+
+    Each connection is read on its own, and stops being read while the
+    queue of a reader it sends lines to has no room.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connections = set()
+        super().__init__(*args, **kwargs)
+
+    def close(self):
+        super().close()
+        for conn in list(self.connections):
+            conn.transport.close()
+
+    async def create_server(self):
+        self.server = await self.loop.create_server(
+            lambda: TcpLogProtocol(self), self.host, self.port)
+
+
+class UdpLogProtocol(asyncio.DatagramProtocol):
+    """Each datagram is a message, its source is the sender address"""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        if self.listener.allowed(addr[0]):
+            self.listener.on_message(addr[0], addr[0], data, wait=False)
+
+    def error_received(self, exc):
+        self.listener.log.warning('UDP log listener error: %s', exc)
+
+
+class UdpListener(NetworkListener):
+    """Receive log lines (or syslog messages) as UDP datagrams.
+
+    Datagrams are dropped while the queue of their reader is full.
+    """
+
+    async def create_server(self):
+        transport, protocol = await self.loop.create_datagram_endpoint(
+            lambda: UdpLogProtocol(self), local_addr=(self.host, self.port))
+        self.server = transport
+
+
+class NetworkLogReader:
+    """Put the log lines received by a NetworkListener into `queue`.
+
+    The lines of a Factorio server can be told apart from those of the
+    other servers sending their logs to the same listener by the syslog
+    host names or sender addresses listed in `log_source`. Without a
+    `log_source`, the reader gets the lines no other reader is listening
+    to, but only from a single game host: its parser keeps the state of a
+    single server, so the lines of the other hosts are rejected.
+
+    Lines are queued by sender, so that the lines of a sender stay in
+    order (eg, a TCP connection and a UDP sender are handled
+    concurrently). Only the addresses listed in `listen_allow` are
+    accepted, if it's set.
+    """
+
+    listener_class = None
+    listener = None
+
+    def __init__(self, loop, queue, listen_host='localhost',
+                 listen_port=5140, listen_allow=None, log_source=None,
+                 max_line_length=65536, **kwargs):
+        self.loop = loop
+        self.queue = queue
+        if isinstance(listen_allow, str):
+            listen_allow = listen_allow.split()
+        self.allow = set(listen_allow) if listen_allow else None
+        if isinstance(log_source, str):
+            log_source = log_source.split()
+        self.sources = set(log_source or ())
+        self.host = None  # the single game host, without sources
+        self.log = logging.getLogger(__name__)
+        self.stats = collections.Counter()
+
+        self.listener = self.listener_class.get(
+            loop, listen_host, int(listen_port),
+            max_line_length=int(max_line_length))
+        self.listener.add(self)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.listener:
+            self.listener.remove(self)
+            self.listener = None
+
+    def allowed(self, address):
+        return self.allow is None or address in self.allow
+
+    def on_message(self, source, host, text):
+        """Queue the lines of a message sent by `host` (the syslog host
+        name or the sender address)"""
+
+        if not self.sources:
+            if self.host is None:
+                self.log.info('Receiving the logs of %s', host)
+                self.host = host
+            elif host != self.host:
+                if not self.stats['rejected']:
+                    self.log.warning(
+                        'Rejecting the logs of %s, only the logs of %s are '
+                        'read (see log_source)', host, self.host)
+                self.stats['rejected'] += 1
+                return
+
+        for line in text.splitlines() or ['']:
+            self.stats['lines'] += 1
+            self.queue.put_nowait(source, line.rstrip('\r'))
+
+
+class TcpLogReader(NetworkLogReader):
+    listener_class = TcpListener
+
+
+class UdpLogReader(NetworkLogReader):
+    listener_class = UdpListener
 
 
 READERS = dict(
     file=FileLogReader,
     stdin=StdinLogReader,
     systemd=SystemdJournalLogReader,
+    replay=ReplayLogReader,
+    tcp=TcpLogReader,
+    udp=UdpLogReader,
 )
 
 
-def new(name, loop, callback, **kwargs):
+def new(name, loop, queue, **kwargs):
     try:
         reader_class = READERS[name]
     except KeyError:
         raise ValueError("Unknown reader name: %s" % name)
 
-    return reader_class(loop, callback, **kwargs)
+    return reader_class(loop, queue, **kwargs)
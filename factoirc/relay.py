@@ -0,0 +1,103 @@
+import re
+import collections
+
+from .templates import Template, ForwardingTemplates
+
+__all__ = ['Route']
+
+
+class Route:
+    """Game events relayed from some servers to other ones over RCON.
+
+    Events from the `sources` servers are formatted with `templates` (a
+    ForwardingTemplates, whose `actions` filter the relayed events) and
+    queued in the RCON forwarder of each of the `destinations`, so that
+    they're batched with the other messages sent to that server. Events
+    whose message (as written in the game, before formatting) matches the
+    `exclude` regex aren't relayed.
+
+    Messages sent over RCON show up in the destination log as coming from
+    `<server>`, which the log parser already ignores. As a second safety
+    net against relay loops, messages starting with one of `prefixes`
+    (the prefixes added by the forwarding and the relays) are ignored too.
+    """
+
+    def __init__(self, name, sources, destinations, templates,
+                 exclude=None, prefixes=()):
+        self.name = name
+        self.sources = set(sources)
+        self.destinations = list(destinations)
+        self.templates = templates
+        self.exclude = re.compile(exclude) if exclude else None
+        self.prefixes = tuple(p for p in prefixes if p)
+        self.stats = collections.Counter()
+
+    def __repr__(self):
+        return 'Route(%r, sources=%r, destinations=%r)' % (
+            self.name, sorted(self.sources),
+            [server.name for server in self.destinations])
+
+    @classmethod
+    def from_config(cls, name, config, servers, prefixes=()):
+        """Create a route from its configuration section
+
+        `from` and `to` list the source and destination server names (all
+        the servers by default), `exclude` is an optional regex, and the
+        other settings are forwarding templates, with `{server}` being the
+        source server name. `prefixes` are other prefixes to ignore
+        besides the ones of the route.
+        """
+
+        config = dict(config)
+        exclude = config.pop('exclude', None)
+        sources = config.pop('from', None)
+        destinations = config.pop('to', None)
+        sources = sources.split() if sources else list(servers)
+        destinations = destinations.split() if destinations else list(servers)
+
+        unknown = set(sources + destinations) - set(servers)
+        if unknown:
+            raise ValueError('Unknown servers in relay %s: %s' % (
+                name, ', '.join(sorted(unknown))))
+
+        templates = ForwardingTemplates(config)
+        prefixes = list(prefixes)
+        if templates.prefix:
+            prefixes.extend(
+                Template(templates.prefix).render(dict(server=server))
+                for server in sources)
+
+        return cls(name, sources, [servers[d] for d in destinations],
+                   templates, exclude=exclude, prefixes=prefixes)
+
+    def relay(self, server, action, username=None, message=None, **kwargs):
+        """Queue a game event of `server` to the destination servers"""
+
+        if server.name not in self.sources:
+            return
+
+        if username == '<server>' or (
+                message and message.startswith(self.prefixes)):
+            self.stats['loops'] += 1
+            return
+
+        if message and self.exclude and self.exclude.search(message):
+            self.stats['filtered'] += 1
+            return
+
+        msg = self.templates.format(
+            action, server=server.name, username=username, message=message,
+            **kwargs)
+        if not msg:
+            self.stats['filtered'] += 1
+            return
+        if msg.strip().startswith('/'):
+            raise ValueError("Formatted message can't begin with /")
+
+        for destination in self.destinations:
+            if destination is server:
+                continue
+            if destination.forwarder.put_nowait('relay', server.name, msg):
+                self.stats['relayed'] += 1
+            else:
+                self.stats['dropped'] += 1
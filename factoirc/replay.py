@@ -0,0 +1,125 @@
+"""Replay an existing Factorio log
+
+By default, the events parsed from the log are written to the standard
+output as JSON lines. With --irc, they're forwarded to IRC by a bot
+using the given configuration file (only its [factoirc] section applies
+to the Factorio server), at --speed times the original pace.
+
+Logs may be gzip-compressed, '-' reads the standard input.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+from .readers import open_log, iter_lines
+from .log_parser import LogParser
+
+__all__ = ['parse_events']
+
+
+def parse_events(lines, parser):
+    """Yield the events parsed from `lines`"""
+
+    for line in lines:
+        event = parser.parse_line(line)
+        if event:
+            yield event
+
+
+def write_events(paths, output, max_peers):
+    """Write the events parsed from the logs as JSON lines, return their
+    count"""
+
+    parser = LogParser(logging.getLogger(__name__), max_peers=max_peers)
+    count = 0
+
+    for path in paths:
+        with open_log(path) as stream:
+            for event in parse_events(iter_lines(stream), parser):
+                output.write(json.dumps(event, sort_keys=True) + '\n')
+                count += 1
+
+    output.flush()
+    return count
+
+
+async def wait_replayed(bot, interval=0.5):
+    """Quit once the whole log was replayed and forwarded to IRC"""
+
+    from . import FactoIRC
+
+    plugin = bot.get_plugin(FactoIRC)
+    server = plugin.servers[plugin.DEFAULT_SERVER]
+
+    while True:
+        await asyncio.sleep(interval)
+        task = server.reader and server.reader.task
+        if not task or not task.done():
+            continue
+        if task.cancelled():
+            break
+        if task.exception():
+            bot.log.error('Unable to replay %s', server.config['file'],
+                          exc_info=task.exception())
+            break
+        if (not len(server.line_queue) and not server.line_queue.busy and
+                not len(plugin.broadcaster)):
+            break
+
+    bot.quit('Replay finished')
+    await asyncio.sleep(interval)
+    bot.loop.stop()
+
+
+def replay_irc(config_file, path, speed):
+    import irc3
+    from irc3.utils import parse_config
+
+    config = parse_config('bot', config_file)
+    factoirc = config.setdefault(__package__, {})
+    factoirc.pop('servers', None)
+    factoirc.pop('relays', None)
+    factoirc.update(method='replay', file=path, replay_speed=speed)
+
+    bot = irc3.IrcBot.from_config(config)
+    bot.loop.create_task(wait_replayed(bot))
+    bot.run(forever=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m factoirc.replay', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', nargs='+', help='log files to replay')
+    parser.add_argument('--irc', metavar='CONFIG',
+                        help='replay to IRC with this bot configuration')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='replay speed for --irc, 0 for no delay '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-peers', type=int, default=1000,
+                        help='peer table size (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    if args.irc:
+        if len(args.log) > 1:
+            parser.error('--irc only replays a single log')
+        return replay_irc(args.irc, args.log[0], args.speed)
+
+    start = time.perf_counter()
+    try:
+        count = write_events(args.log, sys.stdout, args.max_peers)
+    except BrokenPipeError:
+        # Output closed early, eg piped to head
+        sys.stderr.close()
+        return
+
+    print('%d events in %.2fs' % (count, time.perf_counter() - start),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+import collections
+
+__all__ = ['PlayerRoster']
+
+
+class PlayerRoster:
+    """Online players, kept up to date from the game events.
+
+    The roster is reconciled with the list returned by `fetch()` (eg, from
+    the /players command) once it's older than `ttl` seconds. Until then,
+    and while it's being refreshed, it's answered from memory.
+    Concurrent refreshes are coalesced into a single `fetch()` call.
+    """
+
+    JOIN_ACTIONS = {'join'}
+    LEAVE_ACTIONS = {'leave', 'kick', 'ban'}
+
+    def __init__(self, loop, fetch, ttl=60):
+        self.loop = loop
+        self.fetch = fetch
+        self.ttl = ttl
+        self.players = collections.OrderedDict()
+        self.updated = None
+        self.refreshing = None
+
+        # Events received while refreshing, applied on top of the result
+        self.events = []
+
+    def __len__(self):
+        return len(self.players)
+
+    def on_action(self, action, username=None, **kwargs):
+        if not username:
+            return
+        if action not in self.JOIN_ACTIONS | self.LEAVE_ACTIONS:
+            return
+
+        if self.refreshing:
+            self.events.append((action, username))
+        self.apply(action, username)
+
+    def apply(self, action, username):
+        if action in self.JOIN_ACTIONS:
+            self.players[username] = True
+        else:
+            self.players.pop(username, None)
+
+    @property
+    def stale(self):
+        return (self.updated is None or
+                self.loop.time() - self.updated >= self.ttl)
+
+    async def get(self):
+        """Return the list of online players
+
+        Only the first call waits for the list to be fetched.
+        """
+
+        if self.updated is None:
+            await self.refresh()
+        elif self.stale:
+            self.refresh_soon()
+        return list(self.players)
+
+    def refresh_soon(self):
+        if not self.refreshing:
+            self.refreshing = self.loop.create_task(self._refresh())
+            self.refreshing.add_done_callback(self._refreshed)
+        return self.refreshing
+
+    async def refresh(self):
+        await asyncio.shield(self.refresh_soon())
+
+    def _refreshed(self, task):
+        self.refreshing = None
+        self.events = []
+        if not task.cancelled():
+            # Failures are reported to the callers of refresh()
+            task.exception()
+
+    async def _refresh(self):
+        players = await self.fetch()
+        self.players = collections.OrderedDict.fromkeys(players, True)
+        for event in self.events:
+            self.apply(*event)
+        self.updated = self.loop.time()
@@ -0,0 +1,335 @@
+import re
+import time
+import asyncio
+import logging
+
+from . import readers
+from .rcon import RconPool, CircuitBreaker
+from .spool import Spool
+from .log_parser import LogParser
+from .forwarding import RconForwarder
+from .roster import PlayerRoster
+from .line_queue import LineQueue
+from .suppression import RepeatSuppressor
+
+__all__ = ['FactorioServer']
+
+
+ONLINE_RE = re.compile(r'\s*(.*?)\s+\(online\)')
+
+
+class FactorioServer:
+    """A Factorio server bridged with some IRC channels.
+
+    Each server has its own log reader, RCON connections, queues and
+    forwarding templates (`actions`), so that a slow or unreachable server
+    doesn't hold back the other ones. Messages to IRC go through the
+    plugin's broadcaster, which is shared by all the servers.
+    """
+
+    def __init__(self, plugin, name, config, channels, actions):
+        self.plugin = plugin
+        self.bot = plugin.bot
+        self.loop = plugin.bot.loop
+        self.name = name
+        self.config = config
+        self.channels = channels
+        self.actions = actions
+        self.reader = None
+
+        self.log = logging.getLogger('%s.%s' % (plugin.log.name, name))
+        self.metrics = plugin.metrics.labeled(server=name)
+        self.metrics.add_collector(self.collect_metrics)
+
+        self.log_parser = LogParser(
+            self.log, max_peers=int(self.config['max_peers']))
+        self.line_queue = LineQueue(
+            self.loop, self.log_line, self.log,
+            workers=int(self.config['log_workers']),
+            max_size=int(self.config['log_queue_size']),
+            policy=self.config['log_overflow'],
+            on_overflow=self.on_log_overflow,
+        )
+        self.suppressor = None
+        if int(self.config['repeat_max']):
+            self.suppressor = RepeatSuppressor(
+                self.loop, self.on_repeated,
+                window=float(self.config['repeat_window']),
+                max_repeats=int(self.config['repeat_max']),
+                max_keys=int(self.config['repeat_max_keys']),
+            )
+        self.roster = PlayerRoster(
+            self.loop, self.fetch_players,
+            ttl=float(self.config['players_ttl']))
+
+        self.rcon_pool = RconPool(
+            self.config['rcon_host'],
+            int(self.config['rcon_port']),
+            self.config['rcon_password'],
+            size=int(self.config['rcon_pool_size']),
+            idle_check=float(self.config['rcon_idle_check']),
+            ping_timeout=float(self.config['rcon_timeout']),
+            backoff_max=float(self.config['rcon_backoff_max']),
+            pipelined=self.config['rcon_pipelining'],
+            max_response_size=int(self.config['rcon_max_response_size']),
+            metrics=self.metrics,
+            loop=self.loop,
+        )
+
+        self.breaker = CircuitBreaker(
+            self.loop, self.probe_rcon, self.log,
+            threshold=int(self.config['rcon_breaker_threshold']),
+            probe_interval=float(self.config['rcon_probe_interval']),
+            probe_max=float(self.config['rcon_backoff_max']),
+            probe_timeout=float(self.config['rcon_timeout']),
+        )
+
+        self.spool = None
+        if int(self.config['rcon_spool_size']):
+            self.spool = Spool(
+                max_size=int(self.config['rcon_spool_size']),
+                max_age=float(self.config['rcon_spool_max_age']),
+                path=self.config.get('rcon_spool_file'),
+                log=self.log,
+            )
+
+        self.forwarder = RconForwarder(
+            self.loop, self.do_rcon, self.summarize_irc_actions, self.log,
+            window=float(self.config['rcon_batch_window']),
+            max_batch=int(self.config['rcon_batch_size']),
+            max_size=int(self.config['rcon_queue_size']),
+            merge_threshold=int(self.config['rcon_merge_threshold']),
+            spool=self.spool,
+            available=lambda: self.breaker.closed,
+        )
+        self.breaker.on_close = self.forwarder.resume
+
+    def __repr__(self):
+        return 'FactorioServer(%r, channels=%r)' % (self.name, self.channels)
+
+    def start_reader(self):
+        if self.reader or not self.actions['game'].enabled:
+            # Nothing to forward, don't bother to create a reader
+            return
+
+        try:
+            self.reader = readers.new(
+                self.config['method'], self.loop,
+                self.line_queue, **self.config)
+        except Exception:
+            self.log.exception('Unable to read the log')
+
+    def format_action(self, act_type, action, template=None, **kwargs):
+        return self.actions[act_type].format(action, template, **kwargs)
+
+    async def irc_action(self, action, channel, simulate=False, **kwargs):
+        if channel not in self.channels:
+            return
+        msg = self.format_action('irc', action, channel=channel, **kwargs)
+        if simulate:
+            return msg
+        if msg:
+            await self.forwarder.put(action, channel, msg, **kwargs)
+
+    def summarize_irc_actions(self, action, channel, count, **kwargs):
+        """Format the message replacing `count` merged IRC actions"""
+
+        return self.format_action(
+            'irc', action, template='mass' + action,
+            channel=channel, count=count, **kwargs)
+
+    def on_quit(self, nick, reason):
+        for channel in self.channels:
+            if nick in self.bot.channels.get(channel, []):
+                values = dict(nick=nick, reason=reason)
+                msg = self.format_action(
+                    'irc', 'quit', channel=channel, **values)
+                if msg:
+                    self.forwarder.put_nowait(
+                        'quit', channel, msg, **values)
+                return
+
+    async def on_nick(self, nick, new_nick):
+        for channel in self.channels:
+            if new_nick in self.bot.channels.get(channel, []):
+                await self.irc_action(
+                    'newnick', channel=channel, nick=nick,
+                    newnick=new_nick
+                )
+                return
+
+    async def game_action(self, action, simulate=False, **kwargs):
+        msg = self.format_action('game', action, **kwargs)
+        if msg and msg.strip().startswith('/'):
+            raise ValueError("Formatted message can't begin with /")
+        if simulate:
+            return msg
+        if msg:
+            self.broadcast(msg)
+
+    def broadcast(self, msg):
+        self.log.debug('broadcast: %s', msg)
+        self.plugin.broadcaster.broadcast(msg, self.channels)
+
+    async def log_line(self, line):
+        self.log.debug('log line: %s', line)
+        self.metrics.inc('lines_read_total', reader=self.config['method'])
+
+        start = time.perf_counter()
+        result = self.log_parser.parse_line(line)
+        self.metrics.observe('parse_seconds', time.perf_counter() - start)
+
+        if not result:
+            return
+        self.log.debug('log parsed: %r', result)
+        self.roster.on_action(**result)
+        self.plugin.emit(self, result)
+        if self.suppressor is not None and not self.suppressor.allow(result):
+            return
+        self.plugin.route(self, result)
+        await self.game_action(**result)
+
+    def on_repeated(self, count, event):
+        values = dict(event, count=count)
+        action = values.pop('action')
+        try:
+            msg = self.format_action(
+                'game', action, template='repeated', **values)
+        except Exception:
+            self.log.exception('Unable to format the repeated %s', action)
+            return
+        if msg:
+            self.broadcast(msg)
+
+    async def on_log_overflow(self, source, count):
+        await self.game_action('overflow', count=count)
+
+    async def do_rcon(self, text, multi_packet=False):
+        self.log.debug('RCON request: %s', text)
+
+        # Fail right away while the server is known to be unreachable
+        self.breaker.check()
+
+        start = self.loop.time()
+        connect_errors = self.rcon_pool.connect_errors
+        try:
+            result = (await asyncio.wait_for(
+                self.rcon_pool.exec_command(text, multi_packet=multi_packet),
+                timeout=float(self.config['rcon_timeout']),
+            )).splitlines()
+        except asyncio.TimeoutError:
+            self.metrics.inc('rcon_timeouts_total')
+            # Slow commands (eg, a heavy !rcon /c) don't mean the server
+            # is down, unless it couldn't even be connected to
+            if self.rcon_pool.connect_errors > connect_errors:
+                self.breaker.failure()
+            raise
+        except Exception as ex:
+            self.metrics.inc('rcon_errors_total')
+            # Unlike eg a response too large, connection errors mean that
+            # the server may be down
+            if (isinstance(ex, (OSError, asyncio.IncompleteReadError)) or
+                    self.rcon_pool.connect_errors > connect_errors):
+                self.breaker.failure()
+            raise
+        self.breaker.success()
+        self.metrics.observe('rcon_command_seconds', self.loop.time() - start)
+
+        self.log.debug('RCON response: %r', result)
+        return result
+
+    async def probe_rcon(self):
+        await self.rcon_pool.exec_command('')
+
+    async def fetch_players(self):
+        players = await self.do_rcon('/players', multi_packet=True)
+        return [m.group(1)
+                for m in map(ONLINE_RE.match, players)
+                if m]
+
+    def collect_metrics(self):
+        """Return the statistics tracked by the server components"""
+
+        samples = [
+            ('log_queue_size', {}, len(self.line_queue)),
+            ('rcon_queue_size', {}, len(self.forwarder)),
+            ('rcon_pending_requests', {}, self.rcon_pool.pending()),
+            ('players_online', {}, len(self.roster)),
+        ]
+        samples.extend(('parse_hits_total', dict(pattern=pattern), count)
+                       for pattern, count in self.log_parser.hits.items())
+        samples.extend(('peer_table_' + name + ('' if 'size' in name
+                                                else '_total'), {}, value)
+                       for name, value in
+                       self.log_parser.peer_names.stats().items())
+        samples.extend(('log_lines_%s_total' % name, {}, value)
+                       for name, value in self.line_queue.stats.items())
+        samples.extend(('log_reader_%s_total' % name, {}, value)
+                       for name, value in
+                       getattr(self.reader, 'stats', {}).items())
+        samples.extend(('rcon_forwarded_%s_total' % name, {}, value)
+                       for name, value in self.forwarder.stats.items())
+        if self.suppressor is not None:
+            samples.append(('repeat_counters', {}, len(self.suppressor)))
+            samples.extend(('repeat_%s_total' % name, {}, value)
+                           for name, value in self.suppressor.stats.items())
+        samples.append(('rcon_available', {}, int(self.breaker.closed)))
+        samples.extend(('rcon_breaker_%s_total' % name, {}, value)
+                       for name, value in self.breaker.stats.items())
+        if self.spool is not None:
+            samples.append(('rcon_spool_size', {}, len(self.spool)))
+            samples.extend(('rcon_spool_%s_total' % name, {}, value)
+                           for name, value in self.spool.stats.items())
+        return samples
+
+    def stats(self):
+        """Return a summary of the server statistics"""
+
+        metrics = self.metrics
+
+        def latency(name):
+            histogram = metrics.histogram(name)
+            if not histogram or not histogram.count:
+                return 'n/a'
+            return 'avg %.3gms, p50 <%gms, p99 <%gms' % (
+                histogram.sum / histogram.count * 1000,
+                histogram.quantile(.5) * 1000,
+                histogram.quantile(.99) * 1000)
+
+        hits = self.log_parser.hits
+        forwarder = self.forwarder.stats
+        breaker = self.breaker.stats
+        lines = metrics.counter('lines_read_total',
+                                reader=self.config['method'])
+
+        result = [
+            'Log: %d lines read, %d queued, %d dropped, %d parsed (%s), %s' % (
+                lines, len(self.line_queue), self.line_queue.stats['dropped'],
+                sum(hits.values()),
+                ', '.join('%s: %d' % hit for hit in sorted(hits.items())),
+                latency('parse_seconds')),
+            'RCON: %s, %d timeouts, %d errors, connect %s' % (
+                latency('rcon_command_seconds'),
+                metrics.counter('rcon_timeouts_total'),
+                metrics.counter('rcon_errors_total'),
+                latency('rcon_connect_seconds')),
+            'RCON circuit: %s, opened %d times, %d rejected, %d probes' % (
+                'closed' if self.breaker.closed else 'open',
+                breaker['opened'], breaker['rejected'], breaker['probes']),
+            'IRC -> game: %d queued, %d sent in %d batches, '
+            '%d merged, %d dropped' % (
+                len(self.forwarder), forwarder['sent'], forwarder['batches'],
+                forwarder['merged'], forwarder['dropped']),
+        ]
+        if self.suppressor is not None:
+            result.append('Repeats: %d suppressed, %d summaries' % (
+                self.suppressor.stats['suppressed'],
+                self.suppressor.stats['summaries']))
+        if self.spool is not None:
+            spool = self.spool.stats
+            result.append(
+                'Spool: %d waiting, %d spooled, %d sent, %d expired, '
+                '%d dropped' % (
+                    len(self.spool), spool['spooled'], spool['sent'],
+                    spool['expired'], spool['dropped']))
+        return result
@@ -0,0 +1,225 @@
+import abc
+import json
+import asyncio
+import logging
+import sqlite3
+import collections
+
+__all__ = ['EventSink', 'JsonLinesSink', 'SqliteSink', 'new']
+
+
+class EventSink(metaclass=abc.ABCMeta):
+    """Base class for the consumers of the parsed game events.
+
+    `put()` only buffers the event (at most `max_size` of them, the oldest
+    being dropped), so that it never slows down the forwarding. A
+    background task writes the events in batches of up to `batch_size`,
+    as soon as that many are waiting or at most `interval` seconds after
+    they were put.
+
+    Subclasses must implement the `write(events)` coroutine, and can
+    override `close()`.
+    """
+
+    task = None
+
+    def __init__(self, loop, batch_size=100, interval=1, max_size=10000,
+                 log=None):
+        self.loop = loop
+        self.batch_size = batch_size
+        self.interval = interval
+        self.log = log or logging.getLogger(__name__)
+        self.buffer = collections.deque()
+        self.max_size = max_size
+        self.stats = collections.Counter()
+        self.ready = asyncio.Event()
+        self.task = loop.create_task(self.run())
+
+    def __del__(self):
+        if self.task:
+            self.task.cancel()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def put(self, event):
+        if len(self.buffer) >= self.max_size:
+            self.buffer.popleft()
+            self.stats['dropped'] += 1
+
+        self.buffer.append(event)
+        if len(self.buffer) >= self.batch_size:
+            self.ready.set()
+
+    @abc.abstractmethod
+    async def write(self, events):
+        """Write a batch of events"""
+
+    async def flush(self):
+        """Write all the buffered events"""
+
+        while self.buffer:
+            events = [self.buffer.popleft()
+                      for i in range(min(self.batch_size, len(self.buffer)))]
+            try:
+                await self.write(events)
+            except Exception as ex:
+                self.stats['errors'] += 1
+                self.stats['lost'] += len(events)
+                self.log.error('Unable to write %d events to %r: %s',
+                               len(events), self, ex,
+                               exc_info=not isinstance(ex, OSError))
+            else:
+                self.stats['written'] += len(events)
+                self.stats['batches'] += 1
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+            await self.flush()
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+class JsonLinesSink(EventSink):
+    """Write the events as JSON lines, appended to a file or sent to the
+    UNIX socket `socket`.
+
+    Files are written from the default executor, so that a slow disk
+    doesn't block the event loop. The socket is (re)connected when a batch
+    is written, the events are lost while no one is listening.
+    """
+
+    def __init__(self, loop, path=None, socket=None, **kwargs):
+        if bool(path) == bool(socket):
+            raise ValueError('Either a path or a socket is required')
+
+        super().__init__(loop, **kwargs)
+        self.path = path
+        self.socket = socket
+        self.file = None
+        self.writer = None
+
+    def __repr__(self):
+        if self.socket:
+            return 'JsonLinesSink(socket=%r)' % self.socket
+        return 'JsonLinesSink(%r)' % self.path
+
+    @staticmethod
+    def encode(events):
+        return ''.join(json.dumps(event, sort_keys=True) + '\n'
+                       for event in events).encode('utf-8')
+
+    def write_file(self, data):
+        if not self.file:
+            self.file = open(self.path, 'ab')
+        self.file.write(data)
+        self.file.flush()
+
+    async def write(self, events):
+        data = self.encode(events)
+
+        if self.path:
+            await self.loop.run_in_executor(None, self.write_file, data)
+            return
+
+        try:
+            if not self.writer:
+                _, self.writer = await asyncio.open_unix_connection(
+                    self.socket)
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError:
+            if self.writer:
+                self.writer.close()
+            self.writer = None
+            raise
+
+    def close(self):
+        super().close()
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+class SqliteSink(EventSink):
+    """Append the events to the `events` table of a SQLite database.
+
+    The common fields have their own columns, the whole event is stored
+    as JSON in `data`. Each batch is inserted in a single transaction,
+    from the default executor.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            received REAL,
+            server TEXT,
+            action TEXT,
+            username TEXT,
+            message TEXT,
+            data TEXT
+        )
+    '''
+
+    def __init__(self, loop, path, **kwargs):
+        super().__init__(loop, **kwargs)
+        self.path = path
+        self.db = None
+
+    def __repr__(self):
+        return 'SqliteSink(%r)' % self.path
+
+    def insert(self, rows):
+        if not self.db:
+            # Only used by one executor thread at a time (one batch is
+            # written at a time)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(self.SCHEMA)
+
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO events '
+                '(received, server, action, username, message, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    async def write(self, events):
+        rows = [(event.get('received'), event.get('server'),
+                 event.get('action'), event.get('username'),
+                 event.get('message'), json.dumps(event, sort_keys=True))
+                for event in events]
+        await self.loop.run_in_executor(None, self.insert, rows)
+
+    def close(self):
+        super().close()
+        if self.db:
+            self.db.close()
+            self.db = None
+
+
+def new(url, loop, **kwargs):
+    """Create a sink from a URL: file:<path>, unix:<path> or sqlite:<path>"""
+
+    scheme, _, path = url.partition(':')
+    if not path:
+        raise ValueError('Invalid event sink: %s' % url)
+
+    if scheme == 'file':
+        return JsonLinesSink(loop, path=path, **kwargs)
+    elif scheme == 'unix':
+        return JsonLinesSink(loop, socket=path, **kwargs)
+    elif scheme == 'sqlite':
+        return SqliteSink(loop, path, **kwargs)
+
+    raise ValueError('Unknown event sink: %s' % url)
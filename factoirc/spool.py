@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import logging
+import itertools
+import collections
+
+__all__ = ['Spool']
+
+
+class Spool:
+    """Bounded FIFO of the messages that couldn't be sent to the game.
+
+    At most `max_size` lines are kept, the oldest being dropped, and lines
+    older than `max_age` seconds are dropped instead of being sent.
+
+    If `path` is given, lines are also appended to that file (as JSON
+    lines) so that they survive a restart of the bot. The file is
+    rewritten with the remaining lines as they're removed.
+    """
+
+    def __init__(self, max_size=1000, max_age=300, path=None, log=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.path = path
+        self.log = log or logging.getLogger(__name__)
+
+        self.entries = collections.deque()  # (timestamp, line) pairs
+        self.stats = collections.Counter()
+        self.file = None
+        self.file_entries = 0  # lines in the file, removed ones included
+
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries.append((entry['time'], entry['text']))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            return
+        except OSError as ex:
+            self.log.error('Unable to read the spool: %s', ex)
+            return
+
+        self.log.info('%d spooled messages loaded', len(self.entries))
+        while len(self.entries) > self.max_size:
+            self.entries.popleft()
+            self.stats['dropped'] += 1
+        self.expire()
+        self.rewrite()
+
+    def extend(self, lines):
+        if not lines:
+            return
+
+        now = time.time()
+        entries = [(now, line) for line in lines]
+
+        for entry in entries:
+            if len(self.entries) >= self.max_size:
+                self.entries.popleft()
+                self.stats['dropped'] += 1
+            self.entries.append(entry)
+        self.stats['spooled'] += len(entries)
+
+        if self.path:
+            if self.file_entries + len(entries) > 2 * self.max_size:
+                self.rewrite()
+            else:
+                self.append(entries)
+
+    def expire(self):
+        limit = time.time() - self.max_age
+        while self.entries and self.entries[0][0] < limit:
+            self.entries.popleft()
+            self.stats['expired'] += 1
+
+    def peek(self, count):
+        """Return the next `count` lines (at most), without removing them"""
+
+        self.expire()
+        return [line for timestamp, line in
+                itertools.islice(self.entries, count)]
+
+    def pop(self, count):
+        """Remove the first `count` lines, once they've been sent"""
+
+        for i in range(min(count, len(self.entries))):
+            self.entries.popleft()
+        self.stats['sent'] += count
+        if self.path:
+            self.rewrite()
+
+    def append(self, entries):
+        try:
+            if not self.file:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(''.join(
+                json.dumps(dict(time=timestamp, text=line)) + '\n'
+                for timestamp, line in entries))
+            self.file.flush()
+        except OSError as ex:
+            self.log.error('Unable to write to the spool: %s', ex)
+        else:
+            self.file_entries += len(entries)
+
+    def rewrite(self):
+        """Replace the file with the remaining lines"""
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+        try:
+            if not self.entries:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self.file_entries = 0
+                return
+
+            tmp_file = self.path + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for timestamp, line in self.entries:
+                    f.write(json.dumps(dict(time=timestamp, text=line)) +
+                            '\n')
+            os.replace(tmp_file, self.path)
+        except OSError as ex:
+            self.log.error('Unable to write the spool: %s', ex)
+            return
+
+        self.file_entries = len(self.entries)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
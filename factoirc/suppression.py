@@ -0,0 +1,116 @@
+import collections
+
+__all__ = ['RepeatSuppressor']
+
+
+class Counter:
+    __slots__ = ('start', 'current', 'previous', 'suppressed', 'event')
+
+    def __init__(self, start):
+        self.start = start
+        self.current = 0
+        self.previous = 0
+        self.suppressed = 0
+        self.event = None
+
+
+class RepeatSuppressor:
+    """Collapse repeated game events.
+
+    Events are counted by (action, username, message) over a sliding
+    window of `window` seconds, estimated from the counts of the current
+    and previous windows. Once an event was seen `max_repeats` times
+    within a window, its repeats are suppressed, and every `window`
+    seconds `on_summary(count, event)` is called with the number of
+    suppressed repeats and the last of them.
+
+    Counters are only kept for the `max_keys` most recently seen events,
+    and are forgotten once they've been idle for two windows.
+    """
+
+    def __init__(self, loop, on_summary, window=10, max_repeats=3,
+                 max_keys=10000):
+        self.loop = loop
+        self.on_summary = on_summary
+        self.window = window
+        self.max_repeats = max_repeats
+        self.max_keys = max_keys
+
+        self.counters = collections.OrderedDict()  # hash -> Counter
+        self.suppressed = {}  # hash -> Counter, with suppressed repeats
+        self.stats = collections.Counter()
+        self.flush_handle = None
+
+    def __len__(self):
+        return len(self.counters)
+
+    def allow(self, event):
+        """Count an event, return whether it should be forwarded"""
+
+        now = self.loop.time()
+        window = self.window
+        counters = self.counters
+
+        # Least recently seen first
+        while counters:
+            key, counter = next(iter(counters.items()))
+            if now - counter.start < 2 * window and \
+                    len(counters) < self.max_keys:
+                break
+            self.evict(key)
+
+        key = hash((event['action'], event.get('username'),
+                    event.get('message')))
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = Counter(now)
+        else:
+            counters.move_to_end(key)
+
+        elapsed = now - counter.start
+        if elapsed >= window:
+            windows = int(elapsed // window)
+            counter.previous = counter.current if windows == 1 else 0
+            counter.current = 0
+            counter.start += windows * window
+            elapsed -= windows * window
+
+        rate = counter.previous * (window - elapsed) / window + \
+            counter.current
+        counter.current += 1
+
+        if rate < self.max_repeats:
+            return True
+
+        counter.suppressed += 1
+        counter.event = event
+        self.suppressed[key] = counter
+        self.stats['suppressed'] += 1
+        if not self.flush_handle:
+            self.flush_handle = self.loop.call_later(window, self.flush)
+        return False
+
+    def evict(self, key):
+        counter = self.counters.pop(key)
+        self.stats['evicted'] += 1
+        if self.suppressed.pop(key, None):
+            self.summarize(counter)
+
+    def summarize(self, counter):
+        count, counter.suppressed = counter.suppressed, 0
+        event, counter.event = counter.event, None
+        self.stats['summaries'] += 1
+        self.on_summary(count, event)
+
+    def flush(self):
+        """Report the repeats suppressed since the last flush"""
+
+        self.flush_handle = None
+        suppressed, self.suppressed = self.suppressed, {}
+        for counter in suppressed.values():
+            self.summarize(counter)
+
+    def close(self):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
@@ -0,0 +1,132 @@
+import string
+
+from irc3.utils import as_list
+
+__all__ = ['Template', 'ForwardingTemplates']
+
+
+FORMATTER = string.Formatter()
+
+
+class Template:
+    """Format string parsed once.
+
+    Fields referring to `constants` (eg, {c.boldRed}) are resolved when
+    the template is compiled, so rendering only has to substitute the
+    remaining fields.
+    """
+
+    def __init__(self, fmt, constants=None):
+        self.fmt = fmt
+        constants = constants or {}
+        self.parts = []
+
+        for literal, name, spec, conversion in FORMATTER.parse(fmt):
+            if literal:
+                self.parts.append(literal)
+            if name is None:
+                continue
+
+            try:
+                self.parts.append(
+                    self.format_field(name, spec, conversion, constants))
+                continue
+            except (KeyError, AttributeError, IndexError, ValueError):
+                # Not a constant (or an invalid one, which will raise when
+                # the template is rendered)
+                pass
+
+            if name.isidentifier() and not conversion and not spec:
+                self.parts.append((name,))
+            else:
+                self.parts.append((name, spec, conversion, constants))
+
+        # Merge consecutive literals
+        parts = []
+        for part in self.parts:
+            if parts and isinstance(part, str) and isinstance(parts[-1], str):
+                parts[-1] += part
+            else:
+                parts.append(part)
+        self.parts = parts
+
+    def __repr__(self):
+        return 'Template(%r)' % self.fmt
+
+    @staticmethod
+    def format_field(name, spec, conversion, values):
+        obj, _ = FORMATTER.get_field(name, (), values)
+        obj = FORMATTER.convert_field(obj, conversion)
+        spec = FORMATTER.vformat(spec, (), values) if spec else ''
+        return FORMATTER.format_field(obj, spec)
+
+    def render(self, values):
+        result = []
+        for part in self.parts:
+            if isinstance(part, str):
+                result.append(part)
+            elif len(part) == 1:
+                result.append(format(values[part[0]]))
+            else:
+                name, spec, conversion, constants = part
+                values = dict(constants, **values)
+                result.append(
+                    self.format_field(name, spec, conversion, values))
+        return ''.join(result)
+
+
+class ForwardingTemplates:
+    """Forwarding configuration compiled into per-action templates.
+
+    `config` is a forwarding section: the enabled `actions`, an optional
+    `prefix`, `default_<name>` values for empty or missing fields, and a
+    format for each action (or a `default` one).
+    """
+
+    RESERVED = {'actions', 'prefix'}
+
+    def __init__(self, config, constants=None):
+        self.actions = set(as_list(config['actions']))
+        self.defaults = {k[8:]: v
+                         for k, v in config.items()
+                         if k.startswith('default_')}
+
+        self.prefix = prefix = config.get('prefix')
+        self.templates = {}
+        for action, fmt in config.items():
+            if action in self.RESERVED or action.startswith('default_'):
+                continue
+            if not isinstance(fmt, str):
+                fmt = str(fmt)
+            if fmt and prefix:
+                fmt = '%s %s' % (prefix, fmt)
+            self.templates[action] = Template(fmt, constants) if fmt else None
+
+    def __repr__(self):
+        return 'ForwardingTemplates(actions=%r, defaults=%r, templates=%r)' % (
+            self.actions, self.defaults, self.templates)
+
+    @property
+    def enabled(self):
+        return bool(self.actions - {'none'})
+
+    def allows(self, action):
+        return action in self.actions or 'all' in self.actions
+
+    def format(self, action, template=None, **kwargs):
+        """Return the message for an action, or None if it's disabled"""
+
+        if not self.allows(action):
+            return
+
+        template = self.templates.get(
+            template or action, self.templates.get('default'))
+        if not template:
+            raise ValueError('Undefined action: %s' % action)
+
+        values = dict(self.defaults)
+        values.update({k: v
+                       for k, v in kwargs.items()
+                       if k not in values or v})
+
+        return template.render(values)
@@ -32,7 +32,7 @@ setup(
 
     keywords='factorio irc',
 
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
 
     install_requires=['irc3'],
 